@@ -0,0 +1,452 @@
+"""
+Benchmarks of ormageddon hot paths compared with synchronous peewee.
+
+Runs against throwaway Postgres database, for example:
+
+    docker run --rm -d -p 5433:5432 -e POSTGRES_PASSWORD=bench postgres
+    python benchmarks/bench.py --port 5433 --password bench --output results.json
+    python benchmarks/bench.py --port 5433 --password bench --compare results.json
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import peewee
+
+import ormageddon
+
+TABLE = 'ormageddon_benchmark'
+SEED_ROWS = 1000
+SELECT_ROWS = 100
+PAGE_ROWS = 20
+
+
+def make_async_model(db):
+
+    class Item(ormageddon.Model):
+
+        class Meta:
+            database = db
+            db_table = TABLE
+
+        id = ormageddon.PrimaryKeyField()
+        name = peewee.CharField()
+        value = ormageddon.IntegerField()
+
+    return Item
+
+
+def make_sync_model(db):
+
+    class Item(peewee.Model):
+
+        class Meta:
+            database = db
+            db_table = TABLE
+
+        id = peewee.PrimaryKeyField()
+        name = peewee.CharField()
+        value = peewee.IntegerField()
+
+    return Item
+
+
+class AsyncScenarios:
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    async def statement(self, state):
+        model = self.model
+        await model.update(value=model.value + 1).where(model.id == 1).execute()
+
+    async def select(self, state):
+        async for _ in self.model.select().limit(SELECT_ROWS):
+            pass
+
+    async def select_tuples(self, state):
+        async for _ in self.model.select().tuples().limit(SELECT_ROWS):
+            pass
+
+    async def select_dicts(self, state):
+        async for _ in self.model.select().dicts().limit(SELECT_ROWS):
+            pass
+
+    async def select_namedtuples(self, state):
+        async for _ in self.model.select().namedtuples().limit(SELECT_ROWS):
+            pass
+
+    async def page_offset(self, state):
+        offset = state.get('offset', 0)
+        query = self.model.select().order_by(self.model.id)
+        rows = 0
+        async for _ in query[offset:offset + PAGE_ROWS]:
+            rows += 1
+        # scrolling starts over at the end of the table
+        state['offset'] = offset + PAGE_ROWS if rows == PAGE_ROWS else 0
+
+    async def page_keyset(self, state):
+        last = None
+        async for item in self.model.select().after(
+            state.get('last'),
+            size=PAGE_ROWS,
+        ):
+            last = item.id
+        state['last'] = last
+
+    async def insert(self, state):
+        await self.model.insert(name='insert', value=1).execute()
+
+    async def setup_save(self, state):
+        item = state['item'] = self.model(name='save', value=0)
+        await item.save()
+
+    async def save(self, state):
+        item = state['item']
+        item.value += 1
+        await item.save()
+
+    async def transaction(self, state):
+        async with self.db.transaction():
+            await self.model.insert(name='transaction', value=1).execute()
+            await self.model.select().where(self.model.value == 1).first()
+
+
+class SyncScenarios:
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def statement(self, state):
+        # peewee follows every autocommit statement by separate COMMIT
+        model = self.model
+        model.update(value=model.value + 1).where(model.id == 1).execute()
+
+    def select(self, state):
+        for _ in self.model.select().limit(SELECT_ROWS):
+            pass
+
+    def select_tuples(self, state):
+        for _ in self.model.select().tuples().limit(SELECT_ROWS):
+            pass
+
+    def select_dicts(self, state):
+        for _ in self.model.select().dicts().limit(SELECT_ROWS):
+            pass
+
+    def page_offset(self, state):
+        offset = state.get('offset', 0)
+        query = self.model.select().order_by(self.model.id)
+        rows = len(list(query.limit(PAGE_ROWS).offset(offset)))
+        state['offset'] = offset + PAGE_ROWS if rows == PAGE_ROWS else 0
+
+    def page_keyset(self, state):
+        model = self.model
+        query = model.select().order_by(model.id).limit(PAGE_ROWS)
+        if state.get('last') is not None:
+            query = query.where(model.id > state['last'])
+        last = None
+        for item in query:
+            last = item.id
+        state['last'] = last
+
+    def insert(self, state):
+        self.model.insert(name='insert', value=1).execute()
+
+    def setup_save(self, state):
+        state['item'] = self.model.create(name='save', value=0)
+
+    def save(self, state):
+        item = state['item']
+        item.value += 1
+        item.save()
+
+    def transaction(self, state):
+        with self.db.transaction():
+            self.model.insert(name='transaction', value=1).execute()
+            self.model.select().where(self.model.value == 1).first()
+
+
+SCENARIOS = [
+    'statement',
+    'select',
+    'select_tuples',
+    'select_dicts',
+    'select_namedtuples',
+    'page_offset',
+    'page_keyset',
+    'insert',
+    'save',
+    'transaction',
+]
+
+# scenarios reading rows also report rows per second
+ROWS_PER_OPERATION = {
+    'select': SELECT_ROWS,
+    'select_tuples': SELECT_ROWS,
+    'select_dicts': SELECT_ROWS,
+    'select_namedtuples': SELECT_ROWS,
+    'page_offset': PAGE_ROWS,
+    'page_keyset': PAGE_ROWS,
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, wall_time):
+    return {
+        'operations': len(latencies),
+        'qps': len(latencies) / wall_time,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def run_async(scenario, setup, concurrency, operations):
+    latencies = []
+    per_worker = max(1, operations // concurrency)
+
+    async def worker():
+        state = {}
+        if setup is not None:
+            await setup(state)
+        for _ in range(per_worker):
+            started = time.perf_counter()
+            await scenario(state)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_sync(executor, scenario, setup, concurrency, operations):
+    latencies = []
+    per_worker = max(1, operations // concurrency)
+
+    def worker():
+        state = {}
+        if setup is not None:
+            setup(state)
+        for _ in range(per_worker):
+            started = time.perf_counter()
+            scenario(state)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for future in [executor.submit(worker) for _ in range(concurrency)]:
+        future.result()
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def measure_allocations(run, operations):
+    tracemalloc.start()
+    try:
+        run(operations)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def connect_kwargs(args):
+    kwargs = {'host': args.host, 'port': args.port, 'user': args.user}
+    if args.password:
+        kwargs['password'] = args.password
+    return kwargs
+
+
+def prepare(sync_db, sync_model):
+    sync_model.drop_table(fail_silently=True)
+    sync_model.create_table()
+    sync_model.insert_many(
+        {'name': 'seed', 'value': index} for index in range(SEED_ROWS)
+    ).execute()
+
+
+def benchmark(args):
+    loop = asyncio.get_event_loop()
+    # pool is filled up front, so it doesn't grow during timed runs
+    async_db = ormageddon.PostgresqlDatabase(
+        args.database,
+        loop=loop,
+        minsize=max(args.concurrency),
+        maxsize=max(args.concurrency),
+        **connect_kwargs(args)
+    )
+    sync_db = peewee.PostgresqlDatabase(
+        args.database,
+        threadlocals=True,
+        **connect_kwargs(args)
+    )
+    async_model = make_async_model(async_db)
+    sync_model = make_sync_model(sync_db)
+    prepare(sync_db, sync_model)
+    async_scenarios = AsyncScenarios(async_db, async_model)
+    sync_scenarios = SyncScenarios(sync_db, sync_model)
+    # threads and their connections are kept between runs, executor per
+    # concurrency level runs every worker in the same thread each time
+    executors = {
+        concurrency: concurrent.futures.ThreadPoolExecutor(concurrency)
+        for concurrency in args.concurrency
+    }
+    results = []
+    try:
+        for name in args.scenarios:
+            async_scenario = getattr(async_scenarios, name)
+            # peewee has no namedtuples() to compare with
+            sync_scenario = getattr(sync_scenarios, name, None)
+            # both engines prepare worker state outside of timed operations
+            async_setup = getattr(async_scenarios, 'setup_' + name, None)
+            sync_setup = getattr(sync_scenarios, 'setup_' + name, None)
+            for concurrency in args.concurrency:
+                executor = executors[concurrency]
+                engines = [
+                    ('ormageddon', lambda ops: loop.run_until_complete(
+                        run_async(async_scenario, async_setup, concurrency, ops))),
+                ]
+                if sync_scenario is not None:
+                    engines.append(('peewee', lambda ops: run_sync(
+                        executor, sync_scenario, sync_setup, concurrency, ops)))
+                # warm up connections and caches at this concurrency
+                # outside of timed runs
+                for engine, run in engines:
+                    run(args.warmup)
+                for engine, run in engines:
+                    result = run(args.operations)
+                    if name in ROWS_PER_OPERATION:
+                        result['rows_per_sec'] = (
+                            result['qps'] * ROWS_PER_OPERATION[name]
+                        )
+                    result['alloc_peak_kib'] = measure_allocations(
+                        run,
+                        args.allocation_operations,
+                    )
+                    result.update(
+                        scenario=name,
+                        engine=engine,
+                        concurrency=concurrency,
+                    )
+                    results.append(result)
+                    report(result)
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+        sync_model.drop_table(fail_silently=True)
+        sync_db.close()
+        pool = async_db.pool.result()
+        pool.close()
+        loop.run_until_complete(pool.wait_closed())
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, previous=None):
+    line = (
+        '{scenario:<18} {engine:<11} c={concurrency:<4} '
+        '{qps:>10.1f} qps  p50 {p50_ms:>8.2f} ms  p99 {p99_ms:>8.2f} ms  '
+        'alloc {alloc_peak_kib:>9.1f} KiB'
+    ).format(**result)
+    if 'rows_per_sec' in result:
+        line += '  {rows_per_sec:>10.0f} rows/s'.format(**result)
+    if previous is not None:
+        line += '  qps {:+.1%}  p99 {:+.1%}'.format(
+            result['qps'] / previous['qps'] - 1,
+            result['p99_ms'] / previous['p99_ms'] - 1,
+        )
+    print(line)
+
+
+def compare(results, path):
+    with open(path) as previous_file:
+        previous_results = json.load(previous_file)['results']
+    previous = {
+        (result['scenario'], result['engine'], result['concurrency']): result
+        for result in previous_results
+    }
+    print('\nCompared with %s:' % path)
+    for result in results:
+        key = result['scenario'], result['engine'], result['concurrency']
+        report(result, previous.get(key))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default='postgres')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default=None)
+    parser.add_argument(
+        '--scenarios',
+        nargs='+',
+        choices=SCENARIOS,
+        default=SCENARIOS,
+    )
+    parser.add_argument(
+        '--concurrency',
+        nargs='+',
+        type=int,
+        default=[1, 10, 50],
+    )
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--allocation-operations', type=int, default=200)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results of previous run')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = benchmark(args)
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(
+                {
+                    'revision': git_revision(),
+                    'date': datetime.datetime.utcnow().isoformat(),
+                    'python': sys.version,
+                    'platform': platform.platform(),
+                    'parameters': {
+                        'operations': args.operations,
+                        'warmup': args.warmup,
+                        'allocation_operations': args.allocation_operations,
+                        'seed_rows': SEED_ROWS,
+                        'select_rows': SELECT_ROWS,
+                        'page_rows': PAGE_ROWS,
+                    },
+                    'results': results,
+                },
+                output,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+if __name__ == '__main__':
+    main()
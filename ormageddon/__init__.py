@@ -1,3 +1,4 @@
 from ormageddon.db import *
 from ormageddon.fields import *
+from ormageddon.instrumentation import *
 from ormageddon.models import *
@@ -0,0 +1,119 @@
+import asyncio
+
+from ormageddon.query import DeleteQuery, InsertQuery, UpdateQuery
+
+__all__ = [
+    'Batch',
+]
+
+
+def _mergeable(query):
+    if not isinstance(query, (InsertQuery, UpdateQuery, DeleteQuery)):
+        return False
+    if query._returning is not None:
+        return False
+    return not query.model_class._meta.composite_key
+
+
+class Batch:
+
+    def __init__(self, db):
+        self.db = db
+        self._queries = []
+
+    def add(self, query):
+        if not _mergeable(query):
+            # anything else would cost its own round trip anyway
+            raise ValueError(
+                'Only insert, update and delete queries without RETURNING '
+                'can be batched'
+            )
+        future = asyncio.Future(loop=self.db.loop)
+        self._queries.append((query, future))
+        return future
+
+    def _statement(self, queries):
+        quote = self.db.compiler().quote
+        ctes = []
+        columns = []
+        params = []
+        for index, query in enumerate(queries):
+            alias = '_batch_%d' % index
+            sql, query_params = query.sql()
+            if isinstance(query, InsertQuery) and query.is_insert_returning:
+                # ids are aggregated in the order of inserted rows
+                pk_column = quote(query.model_class._meta.primary_key.db_column)
+                column = 'array_agg(%s ORDER BY _ordinal)' % pk_column
+                source = (
+                    '(SELECT %s, row_number() OVER () AS _ordinal FROM %s) '
+                    'AS %s' % (pk_column, alias, alias)
+                )
+            else:
+                sql += ' RETURNING 1'
+                column = 'count(*)'
+                source = alias
+            ctes.append('%s AS (%s)' % (alias, sql))
+            columns.append('(SELECT %s FROM %s)' % (column, source))
+            params.extend(query_params)
+        return 'WITH %s SELECT %s' % (', '.join(ctes), ', '.join(columns)), params
+
+    def _result(self, query, value):
+        if not isinstance(query, InsertQuery):
+            return value
+        if not query.is_insert_returning:
+            return True
+        pk_field = query.model_class._meta.primary_key
+        id_list = [pk_field.python_value(pk) for pk in value or ()]
+        if not query._is_multi_row_insert:
+            return id_list[0] if id_list else None
+        if query._return_id_list:
+            return id_list
+        return True
+
+    async def _execute(self, queries):
+        for query in queries:
+            query._invalidate_identity_map()
+        sql, params = self._statement(queries)
+        cursor = await self.db.execute_sql(sql, params)
+        try:
+            row = await cursor.fetchone()
+        finally:
+            cursor.close()
+            transaction = self.db.get_transaction()
+            for query in queries:
+                query._invalidate_result_cache(transaction)
+        return [
+            self._result(query, value)
+            for query, value in zip(queries, row)
+        ]
+
+    async def execute(self):
+        queries, self._queries = self._queries, []
+        if not queries:
+            return
+        try:
+            # independent writes cost single round trip being sent
+            # as data-modifying CTEs of one statement
+            results = await self._execute([query for query, _ in queries])
+        except asyncio.CancelledError:
+            for _, future in queries:
+                future.cancel()
+            raise
+        except Exception as error:
+            # every caller gets the actual failure of the statement
+            for _, future in queries:
+                future.set_exception(error)
+            raise
+        for (_, future), result in zip(queries, results):
+            future.set_result(result)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.execute()
+        else:
+            for _, future in self._queries:
+                future.cancel()
+            self._queries = []
@@ -0,0 +1,71 @@
+import collections
+import time
+
+__all__ = [
+    'ResultCache',
+]
+
+_Entry = collections.namedtuple('_Entry', 'expires tables description rows')
+
+
+class ResultCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        self._keys = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self._remove(key)
+        self.misses += 1
+
+    def set(self, key, tables, ttl, description, rows):
+        self._remove(key)
+        while self._entries and len(self._entries) >= self.size:
+            evicted, entry = self._entries.popitem(last=False)
+            self._unindex(evicted, entry.tables)
+            self.evictions += 1
+        entry = self._entries[key] = _Entry(
+            time.monotonic() + ttl,
+            tables,
+            description,
+            rows,
+        )
+        for table in tables:
+            self._keys[table].add(key)
+        return entry
+
+    def invalidate(self, table=None):
+        self.invalidations += 1
+        if table is None:
+            self._entries.clear()
+            self._keys.clear()
+            return
+        for key in self._keys.pop(table, ()):
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry.tables)
+
+    def _unindex(self, key, tables):
+        for table in tables:
+            keys = self._keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[table]
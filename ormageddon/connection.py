@@ -0,0 +1,30 @@
+__all__ = [
+    'ConnectionContext',
+]
+
+
+class ConnectionContext:
+
+    def __init__(self, db):
+        self.db = db
+        self._connection = None
+        self._pinned = False
+
+    async def __aenter__(self):
+        if self.db.transaction_depth():
+            # transaction already holds its own connection
+            return
+        connection = self.db.get_task_connection()
+        if connection is None:
+            connection = self._connection = await self.db.get_conn()
+        self.db.push_connection(connection)
+        self._pinned = True
+        return connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._pinned:
+            self.db.pop_connection()
+            self._pinned = False
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            await self.db.release_conn(connection)
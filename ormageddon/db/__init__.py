@@ -4,9 +4,12 @@ import contextlib
 import peewee
 import tasklocals
 
+from ormageddon.db.admission import Overloaded, PriorityContext
+from ormageddon.identity import IdentityMapContext
 from ormageddon.transaction import Transaction
 
 __all__ = [
+    'Overloaded',
     'PostgresqlDatabase',
 ]
 
@@ -17,14 +20,36 @@ class TaskConnectionLocal(peewee._BaseConnectionLocal, tasklocals.local):
         # ignore asyncio current task absence
         with contextlib.suppress(RuntimeError):
             super().__init__()
+            self.connections = []
+            self.identity_map = None
+            self.priority = None
 
 
 class Database(peewee.Database):
 
+    insert_batch_size = 1000
+    update_batch_size = 1000
+
+    # lower value is served first by admission control
+    priorities = {
+        'interactive': 0,
+        'default': 1,
+        'batch': 2,
+    }
+
     def __init__(self, *args, loop=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.loop = loop or asyncio.get_event_loop()
         self.__local = TaskConnectionLocal(loop=self.loop)
+        self.instruments = []
+        self.connections_acquired = 0
+        self.connections_released = 0
+
+    def add_instrument(self, instrument):
+        self.instruments.append(instrument)
+
+    def remove_instrument(self, instrument):
+        self.instruments.remove(instrument)
 
     def set_autocommit(self, autocommit):
         self.__local.autocommit = autocommit
@@ -40,12 +65,42 @@ class Database(peewee.Database):
     def pop_transaction(self):
         self.__local.transactions.pop()
 
+    def push_connection(self, connection):
+        self.__local.connections.append(connection)
+
+    def pop_connection(self):
+        return self.__local.connections.pop()
+
+    def get_task_connection(self):
+        if self.__local.connections:
+            return self.__local.connections[-1]
+
+    def identity_map(self):
+        return IdentityMapContext(self)
+
+    def get_identity_map(self):
+        return self.__local.identity_map
+
+    def set_identity_map(self, identity_map):
+        self.__local.identity_map = identity_map
+
+    def priority(self, priority):
+        if priority not in self.priorities:
+            raise ValueError('Unknown priority: %s' % priority)
+        return PriorityContext(self, priority)
+
+    def get_priority(self):
+        return self.__local.priority or 'default'
+
+    def set_priority(self, priority):
+        self.__local.priority = priority
+
     def transaction_depth(self):
         return len(self.__local.transactions)
 
     def get_transaction(self, create_if_not_exists=False):
-        if self.transaction_depth() == 1:
-            return self.__local.transactions[-1]
+        if self.__local.transactions:
+            return self.__local.transactions[0]
         if create_if_not_exists:
             transaction = Transaction(self)
             transaction.disable_autocommit()
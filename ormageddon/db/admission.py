@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+
+import peewee
+
+__all__ = [
+    'AdmissionController',
+    'Overloaded',
+    'PriorityContext',
+]
+
+
+class Overloaded(peewee.OperationalError):
+    pass
+
+
+class AdmissionController:
+
+    def __init__(self, max_in_flight, max_queue=None, timeout=None, loop=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.loop = loop
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+        self.timeouts = 0
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            return
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            self.shed += 1
+            raise Overloaded('Too many queries are waiting for connection')
+        waiter = asyncio.Future(loop=self.loop)
+        # lower value means higher priority, equal ones are served in order
+        heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+        self.queued += 1
+        try:
+            await asyncio.wait([waiter], timeout=self.timeout, loop=self.loop)
+        except:
+            self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            self.timeouts += 1
+            raise Overloaded('Timed out waiting for connection')
+
+    def _abandon(self, waiter):
+        if waiter.done():
+            # slot was already handed over to this waiter
+            self.release()
+        else:
+            waiter.cancel()
+            self.queued -= 1
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                # slot is passed to the waiter as is
+                self.queued -= 1
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'shed': self.shed,
+            'timeouts': self.timeouts,
+        }
+
+
+class PriorityContext:
+
+    def __init__(self, db, priority):
+        self.db = db
+        self.priority = priority
+        self._previous = None
+
+    async def __aenter__(self):
+        self._previous = self.db.get_priority()
+        self.db.set_priority(self.priority)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.db.set_priority(self._previous)
@@ -1,26 +1,228 @@
 import asyncio
-import weakref
+import collections
+import functools
+import itertools
 
 import aiopg
 import peewee
 
 from cached_property import cached_property
 
+from ormageddon.batch import Batch
+from ormageddon.cache import ResultCache
+from ormageddon.connection import ConnectionContext
 from ormageddon.db import Database
-from ormageddon.transaction import TransactionContext
+from ormageddon.db.admission import AdmissionController
+from ormageddon.db.statements import (
+    INDETERMINATE_DATATYPE,
+    SAVEPOINT,
+    SQLCache,
+    StatementCache,
+)
+from ormageddon.transaction import Savepoint, TransactionContext, _sqlstate
 from ormageddon.utils import force_future
-from ormageddon.wrappers import NaiveQueryResultWrapper
+from ormageddon.wrappers import (
+    RESULTS_NAMEDTUPLES,
+    DictQueryResultWrapper,
+    NaiveQueryResultWrapper,
+    NamedTuplesQueryResultWrapper,
+    TuplesQueryResultWrapper,
+)
 
 
-class PostgresqlDatabase(peewee.PostgresqlDatabase, Database):
+class PooledCursor:
+
+    __slots__ = ('_cursor', '_release')
+
+    def __init__(self, cursor, release):
+        self._cursor = cursor
+        self._release = release
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def close(self):
+        self._cursor.close()
+        self.release()
+
+    def __del__(self):
+        # last resort for abandoned cursors, normally connection is
+        # already released by this moment
+        self.release()
+
+
+class BufferedCursor:
+
+    __slots__ = ('description', 'rowcount', '_rows')
+
+    def __init__(self, description, rows, rowcount=-1):
+        self.description = description
+        self.rowcount = rowcount
+        self._rows = iter(rows)
+
+    async def fetchone(self):
+        return next(self._rows, None)
+
+    async def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        self._rows = iter(())
+
+
+class ServerSideCursor:
 
-    async def _create_pool(self):
+    _names = itertools.count()
+
+    def __init__(
+        self,
+        db,
+        connection,
+        batch_size,
+        own_transaction=True,
+        release_connection=False,
+        timeout=None,
+    ):
+        self.db = db
+        self.connection = connection
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.name = 'ormageddon_cursor_%d' % next(self._names)
+        self.description = None
+        self._own_transaction = own_transaction
+        self._release_connection = release_connection
+        self._cursor = None
+        self._rows = collections.deque()
+        self._exhausted = False
+        self._closing = None
+
+    def _fetch_statement(self):
+        return 'FETCH FORWARD %d FROM %s' % (self.batch_size, self.name)
+
+    async def _fetch(self, sql, params=None):
         try:
-            return await aiopg.create_pool(
+            with self.db.exception_wrapper():
+                await self._cursor.execute(sql, params, timeout=self.timeout)
+                rows = await self._cursor.fetchall()
+        except BaseException:
+            # failed or cancelled stream can't be continued, so connection
+            # is given back without waiting for consumer to close it
+            self.close()
+            raise
+        self.description = self._cursor.description
+        self._rows.extend(rows)
+        self._exhausted = len(rows) < self.batch_size
+
+    async def open(self, sql, params=None):
+        statements = [
+            'DECLARE %s NO SCROLL CURSOR FOR %s' % (self.name, sql),
+            self._fetch_statement(),
+        ]
+        if self._own_transaction:
+            statements.insert(0, 'BEGIN')
+        self._cursor = await self.connection.cursor()
+        # declaring cursor and fetching first batch costs single round trip
+        await self._fetch('; '.join(statements), params)
+
+    async def fetchone(self):
+        if not self._rows and not self._exhausted:
+            await self._fetch(self._fetch_statement())
+        if self._rows:
+            return self._rows.popleft()
+
+    async def _close(self):
+        try:
+            if self._cursor is not None:
+                if self._own_transaction:
+                    # cursor is closed along with the transaction
+                    await self._cursor.execute('COMMIT')
+                else:
+                    await self._cursor.execute('CLOSE %s' % self.name)
+        finally:
+            if self._cursor is not None:
+                self._cursor.close()
+            if self._release_connection:
+                self.db.release_conn(self.connection)
+
+    def close(self):
+        if self._closing is None:
+            self._rows.clear()
+            self._exhausted = True
+            self._closing = asyncio.ensure_future(
+                self._close(),
+                loop=self.db.loop,
+            )
+        return self._closing
+
+    @property
+    def closed(self):
+        return self._closing is not None
+
+    def __del__(self):
+        # consumer abandoned the stream without closing it
+        if self._closing is None and not self.db.loop.is_closed():
+            self.close()
+
+
+class PostgresqlDatabase(peewee.PostgresqlDatabase, Database):
+
+    def __init__(
+        self,
+        *args,
+        sql_cache_size=1000,
+        statement_cache_size=0,
+        result_cache_size=1000,
+        replicas=(),
+        replica_selection='round_robin',
+        max_in_flight=None,
+        max_queue=None,
+        acquire_timeout=None,
+        query_timeout=None,
+        statement_timeout=None,
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.query_timeout = query_timeout
+        if statement_timeout is not None:
+            # server cancels statements itself even if client is gone
+            options = '%s -c statement_timeout=%d' % (
+                self.connect_kwargs.get('options', ''),
+                statement_timeout * 1000,
+            )
+            self.connect_kwargs['options'] = options.strip()
+        assert replica_selection in ('round_robin', 'least_loaded'), \
+            "Unknown replica selection strategy: %s" % replica_selection
+        self.replicas = list(replicas)
+        self.replica_selection = replica_selection
+        self._replica_index = itertools.cycle(range(len(self.replicas)))
+        self._connection_pools = {}
+        self._admitted = set()
+        self.admission = None
+        if max_in_flight:
+            self.admission = AdmissionController(
+                max_in_flight,
+                max_queue=max_queue,
+                timeout=acquire_timeout,
                 loop=self.loop,
-                database=self.database,
-                **self.connect_kwargs
             )
+        self.sql_cache = None
+        if sql_cache_size:
+            self.sql_cache = SQLCache(sql_cache_size)
+        self.statement_cache = None
+        if statement_cache_size:
+            self.statement_cache = StatementCache(statement_cache_size)
+        self.result_cache = ResultCache(result_cache_size)
+
+    async def _create_pool(self, **connect_kwargs):
+        kwargs = dict(self.connect_kwargs, database=self.database)
+        kwargs.update(connect_kwargs)
+        try:
+            return await aiopg.create_pool(loop=self.loop, **kwargs)
         except:
             self.loop.stop()
             raise
@@ -29,86 +231,441 @@ class PostgresqlDatabase(peewee.PostgresqlDatabase, Database):
     def pool(self):
         return asyncio.ensure_future(self._create_pool(), loop=self.loop)
 
-    async def get_conn(self):
-        pool = await self.pool
+    @cached_property
+    def replica_pools(self):
+        return [
+            asyncio.ensure_future(self._create_pool(**replica), loop=self.loop)
+            for replica in self.replicas
+        ]
+
+    async def _get_pool(self, read_only=False):
+        if not read_only or not self.replicas:
+            return await self.pool
+        if self.replica_selection == 'least_loaded':
+            pools = await asyncio.gather(*self.replica_pools, loop=self.loop)
+            return min(pools, key=lambda pool: pool.size - pool.freesize)
+        return await self.replica_pools[next(self._replica_index)]
+
+    async def _acquire(self, pool):
+        if not self.instruments:
+            return await pool.acquire()
+        started = self.loop.time()
         connection = await pool.acquire()
+        wait = self.loop.time() - started
+        for instrument in self.instruments:
+            instrument.connection_acquired(connection, wait)
         return connection
 
-    async def get_cursor(
-        self,
-        connection=None,
-        release_new_connection=True,
-        force_release_connection=False,
-    ):
-        need_release_connection = release_new_connection and not connection
-        connection = connection or await self.get_conn()
-        cursor = await connection.cursor()
-        if need_release_connection or force_release_connection:
-            pool = await self.pool
-            weakref.finalize(cursor, pool.release, connection)
-        return cursor
+    async def get_conn(self, read_only=False, priority=None, admit=True):
+        # statements are often executed by tasks spawned on behalf of the
+        # caller, so the caller passes its priority explicitly
+        if priority is None:
+            priority = self.get_priority()
+        pool = await self._get_pool(read_only)
+        admission = self.admission if admit else None
+        if admission is None:
+            connection = await self._acquire(pool)
+        else:
+            await admission.acquire(self.priorities[priority])
+            try:
+                connection = await self._acquire(pool)
+            except:
+                admission.release()
+                raise
+            self._admitted.add(connection)
+        self.connections_acquired += 1
+        self._connection_pools[connection] = pool
+        return connection
+
+    def release_conn(self, connection):
+        pool = self._connection_pools.pop(connection, None)
+        if pool is None:
+            pool = self.pool.result()
+        if connection in self._admitted:
+            self._admitted.discard(connection)
+            self.admission.release()
+        self.connections_released += 1
+        for instrument in self.instruments:
+            instrument.connection_released(connection)
+        return pool.release(connection)
+
+    def pool_stats(self):
+        pools = [('primary', self.pool)]
+        if 'replica_pools' in self.__dict__:
+            pools.extend(
+                ('replica_%d' % index, pool)
+                for index, pool in enumerate(self.replica_pools)
+            )
+        stats = {}
+        for name, pool in pools:
+            if pool.done() and not pool.exception():
+                pool = pool.result()
+                stats[name] = {
+                    'size': pool.size,
+                    'freesize': pool.freesize,
+                    'minsize': pool.minsize,
+                    'maxsize': pool.maxsize,
+                    'used': pool.size - pool.freesize,
+                }
+        if self.admission is not None:
+            stats['admission'] = self.admission.stats()
+        return stats
+
+    async def get_cursor(self, connection=None, read_only=False, priority=None):
+        if connection is not None:
+            return await connection.cursor()
+        connection = await self.get_conn(read_only, priority=priority)
+        try:
+            cursor = await connection.cursor()
+        except:
+            self.release_conn(connection)
+            raise
+        return PooledCursor(
+            cursor,
+            release=functools.partial(self.release_conn, connection),
+        )
 
     def get_result_wrapper(self, wrapper_type):
         if wrapper_type == peewee.RESULTS_NAIVE:
             return NaiveQueryResultWrapper
+        elif wrapper_type == peewee.RESULTS_TUPLES:
+            return TuplesQueryResultWrapper
+        elif wrapper_type == peewee.RESULTS_DICTS:
+            return DictQueryResultWrapper
+        elif wrapper_type == RESULTS_NAMEDTUPLES:
+            return NamedTuplesQueryResultWrapper
+
+    def _before_execute(self, instruments, sql, params, model):
+        for instrument in instruments:
+            instrument.before_execute(sql, params, model)
+        return self.loop.time()
+
+    def _after_execute(
+        self,
+        instruments,
+        sql,
+        params,
+        model,
+        started,
+        rowcount,
+        error=None,
+    ):
+        duration = self.loop.time() - started
+        for instrument in instruments:
+            instrument.after_execute(sql, params, model, duration, rowcount, error)
 
     async def _execute_sql(
         self,
         sql,
         params=None,
-        require_commit=True,
         connection=None,
+        read_only=False,
+        model=None,
+        timeout=None,
+        in_transaction=False,
+        priority=None,
     ):
+        if timeout is None:
+            timeout = self.query_timeout
+        # instruments added or removed while the statement is executed
+        # get either both events or none
+        instruments = tuple(self.instruments)
         with self.exception_wrapper():
-            cursor = await self.get_cursor(connection)
-            await cursor.execute(sql, params)
-            if require_commit:
-                await self._commit(cursor.connection)
-        return cursor
+            cursor = await self.get_cursor(
+                connection,
+                read_only=read_only,
+                priority=priority,
+            )
+            if instruments:
+                # waiting for connection is reported by connection_acquired()
+                started = self._before_execute(instruments, sql, params, model)
+            statement = sql
+            if self.statement_cache is not None:
+                statement = self.statement_cache.statement(
+                    cursor.connection,
+                    sql,
+                    params,
+                    in_transaction=in_transaction,
+                )
+            try:
+                # on timeout or cancellation aiopg cancels the statement
+                # on the server side before raising
+                try:
+                    await cursor.execute(statement, params, timeout=timeout)
+                except Exception as error:
+                    if (
+                        statement is sql or
+                        _sqlstate(error) != INDETERMINATE_DATATYPE
+                    ):
+                        raise
+                    self.statement_cache.discard(cursor.connection)
+                    self.statement_cache.unpreparable(sql)
+                    if in_transaction:
+                        await cursor.execute(
+                            'ROLLBACK TO SAVEPOINT %s' % SAVEPOINT,
+                        )
+                    await cursor.execute(sql, params, timeout=timeout)
+            except BaseException as error:
+                if self.statement_cache is not None:
+                    # server may not have statements we think it has
+                    self.statement_cache.discard(cursor.connection)
+                # connection busy with cancelled statement is closed by pool
+                cursor.close()
+                if instruments:
+                    self._after_execute(
+                        instruments,
+                        sql,
+                        params,
+                        model,
+                        started,
+                        None,
+                        error,
+                    )
+                raise
+        if instruments:
+            self._after_execute(
+                instruments,
+                sql,
+                params,
+                model,
+                started,
+                cursor.rowcount,
+            )
+        if connection is not None:
+            return cursor
+        try:
+            # the whole result is already received from the server, so
+            # connection is given back before the result is read and
+            # abandoned results can't hold it
+            rows = []
+            if cursor.description is not None:
+                rows = await cursor.fetchall()
+            return BufferedCursor(cursor.description, rows, cursor.rowcount)
+        finally:
+            cursor.close()
 
-    def execute_sql(self, sql, params=None, require_commit=True):
+    def execute_sql(
+        self,
+        sql,
+        params=None,
+        require_commit=True,
+        read_only=False,
+        model=None,
+        timeout=None,
+    ):
+        # aiopg connections always work in autocommit mode, so statements
+        # executed outside of transaction are committed by the server itself
+        # and `require_commit` never costs an extra COMMIT round trip
         transaction = self.get_transaction()
-        connection = transaction and transaction.connection
+        if transaction:
+            connection = transaction.connection
+        else:
+            connection = self.get_task_connection()
         return self._execute_sql(
             sql,
             params=params,
-            require_commit=require_commit and self.get_autocommit(),
             connection=connection,
+            read_only=read_only,
+            model=model,
+            timeout=timeout,
+            in_transaction=bool(transaction),
+            priority=self.get_priority(),
         )
 
-    def transaction(self):
-        transaction = self.get_transaction(create_if_not_exists=True)
-        return TransactionContext(transaction)
+    def execute_sql_cached(
+        self,
+        sql,
+        params,
+        tables,
+        ttl,
+        model=None,
+        timeout=None,
+    ):
+        key = sql, tuple(params or ())
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        if key is None or self.transaction_depth():
+            # transaction may see its own uncommitted changes
+            return self.execute_sql(
+                sql,
+                params,
+                read_only=True,
+                model=model,
+                timeout=timeout,
+            )
+        return self._execute_sql_cached(
+            key,
+            tables,
+            ttl,
+            functools.partial(
+                self._execute_sql,
+                sql,
+                params,
+                connection=self.get_task_connection(),
+                read_only=True,
+                model=model,
+                timeout=timeout,
+                priority=self.get_priority(),
+            ),
+        )
 
-    async def _begin(self, transaction):
-        connection = transaction.started and transaction.connection or None
-        cursor = await self.get_cursor(
-            connection=connection,
-            release_new_connection=False,
+    async def _execute_sql_cached(self, key, tables, ttl, execute_sql):
+        cache = self.result_cache
+        entry = cache.get(key)
+        if entry is None:
+            invalidations = cache.invalidations
+            cursor = await execute_sql()
+            try:
+                rows = await cursor.fetchall()
+                description = cursor.description
+            finally:
+                cursor.close()
+            if invalidations != cache.invalidations:
+                # rows may be read before concurrent write was finished
+                return BufferedCursor(description, rows)
+            entry = cache.set(key, tables, ttl, description, rows)
+        return BufferedCursor(entry.description, entry.rows)
+
+    async def listen_invalidations(self, channel='ormageddon_cache'):
+        # connection is held for the whole lifetime of the listener, so it
+        # must not occupy one of the admission slots
+        connection = await self.get_conn(admit=False)
+        try:
+            cursor = await connection.cursor()
+            await cursor.execute('LISTEN %s' % channel)
+            while True:
+                notify = await connection.notifies.get()
+                self.result_cache.invalidate(notify.payload or None)
+        finally:
+            # listening connection must not be reused by anyone else
+            connection.close()
+            self.release_conn(connection)
+
+    async def execute_sql_stream(
+        self,
+        sql,
+        params=None,
+        batch_size=100,
+        read_only=False,
+        timeout=None,
+    ):
+        transaction = self.get_transaction()
+        if transaction:
+            connection = transaction.connection
+            release_connection = False
+        else:
+            connection = self.get_task_connection()
+            release_connection = connection is None
+            connection = connection or await self.get_conn(read_only)
+        cursor = ServerSideCursor(
+            self,
+            connection,
+            batch_size,
+            own_transaction=not transaction,
+            release_connection=release_connection,
+            timeout=timeout or self.query_timeout,
         )
-        await cursor.execute('BEGIN')
-        transaction.connection = cursor.connection
+        try:
+            await cursor.open(sql, params)
+        except:
+            await cursor.close()
+            raise
+        return cursor
+
+    def connection(self):
+        return ConnectionContext(self)
+
+    def batch(self):
+        return Batch(self)
+
+    def transaction(self, retries=0, backoff=0.1, on_retry=None):
+        return TransactionContext(
+            self,
+            retries=retries,
+            backoff=backoff,
+            on_retry=on_retry,
+        )
+
+    def atomic(self):
+        transaction = self.get_transaction()
+        if transaction:
+            return Savepoint(transaction)
+        return self.transaction()
+
+    async def _begin(self, transaction, connection=None, priority=None):
+        if transaction.started:
+            connection = transaction.connection
+        else:
+            transaction.release_connection = connection is None
+            connection = connection or await self.get_conn(priority=priority)
+        try:
+            cursor = await self.get_cursor(connection)
+            await cursor.execute('BEGIN')
+        except:
+            if not transaction.started and transaction.release_connection:
+                self.release_conn(connection)
+            raise
+        transaction.connection = connection
 
     def begin(self):
         transaction = self.get_transaction(create_if_not_exists=True)
         return transaction.begin()
 
-    async def _commit(self, connection, force_release_connection=False):
-        cursor = await self.get_cursor(
+    async def execute_transaction_statement(self, statement, connection):
+        with self.exception_wrapper():
+            cursor = await self.get_cursor(connection)
+            try:
+                await cursor.execute(statement)
+            finally:
+                cursor.close()
+
+    async def _finish_transaction(
+        self,
+        statement,
+        connection,
+        force_release_connection=False,
+    ):
+        try:
+            await self.execute_transaction_statement(statement, connection)
+        finally:
+            if force_release_connection:
+                self.release_conn(connection)
+
+    def _commit(self, connection, force_release_connection=False):
+        return self._finish_transaction(
+            'COMMIT',
             connection,
             force_release_connection=force_release_connection,
         )
-        await cursor.execute('COMMIT')
 
-    async def _rollback(self, connection, force_release_connection=False):
-        cursor = await self.get_cursor(
+    def _rollback(self, connection, force_release_connection=False):
+        return self._finish_transaction(
+            'ROLLBACK',
             connection,
             force_release_connection=force_release_connection,
         )
-        await cursor.execute('ROLLBACK')
+
+    def _invalidate_written_tables(self, transaction):
+        tables, transaction.written_tables = transaction.written_tables, set()
+        for table in tables:
+            self.result_cache.invalidate(table)
+
+    async def _close_transaction(self, transaction, commit_or_rollback):
+        try:
+            await commit_or_rollback(
+                connection=transaction.connection,
+                force_release_connection=transaction.release_connection,
+            )
+        finally:
+            self._invalidate_written_tables(transaction)
 
     async def _restart_transaction(self, transaction, commit_or_rollback):
-        await commit_or_rollback(connection=transaction.connection)
+        try:
+            await commit_or_rollback(connection=transaction.connection)
+        finally:
+            self._invalidate_written_tables(transaction)
         await self._begin(transaction)
 
     def commit_or_rollback(
@@ -124,10 +681,7 @@ class PostgresqlDatabase(peewee.PostgresqlDatabase, Database):
             if close_transaction:
                 self.pop_transaction()
                 transaction.restore_autocommit()
-                return commit_or_rollback(
-                    connection=transaction.connection,
-                    force_release_connection=True,
-                )
+                return self._close_transaction(transaction, commit_or_rollback)
             return self._restart_transaction(transaction, commit_or_rollback)
         # TODO raise warning?
         return force_future(None, loop=self.loop)
@@ -0,0 +1,284 @@
+import collections
+import inspect
+import itertools
+import re
+import weakref
+
+import peewee
+
+__all__ = [
+    'SQLCache',
+    'StatementCache',
+]
+
+# indeterminate_datatype
+INDETERMINATE_DATATYPE = '42P18'
+
+SAVEPOINT = 'ormageddon_prepare'
+
+_placeholder = re.compile(r'%[s%]')
+
+
+def _positional(sql):
+    counter = itertools.count(1)
+
+    def replace(match):
+        if match.group() == '%%':
+            return '%%'
+        return '$%d' % next(counter)
+
+    return _placeholder.sub(replace, sql), next(counter) - 1
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _walk(node, conv, key, params):
+    # mirrors QueryCompiler.parse_node(), but instead of SQL collects
+    # structure of the node and parameters exactly as compiler would
+    node_type = getattr(node, '_node_type', None)
+    if node_type == 'expression':
+        if isinstance(node.lhs, peewee.Field):
+            conv = node.lhs
+        key.append((node_type, node.op, node.flat))
+        _walk(node.lhs, conv, key, params)
+        _walk(node.rhs, conv, key, params)
+    elif node_type == 'field':
+        if not inspect.isclass(node.model_class):
+            raise _Unsupported
+        key.append((node_type, node.model_class, node.name))
+    elif node_type in ('param', 'passthrough'):
+        key.append(node_type)
+        value = node.conv(node.value) if node.conv else node.value
+        if node_type == 'param' and conv:
+            value = conv.db_value(value)
+        params.append(value)
+    elif node_type == 'func':
+        key.append((node_type, node.name, node._coerce, len(node.arguments)))
+        for argument in node.arguments:
+            _walk(argument, node._coerce and conv or None, key, params)
+    elif node_type == 'clause':
+        key.append((node_type, node.glue, node.parens, len(node.nodes)))
+        for clause_node in node.nodes:
+            _walk(clause_node, conv, key, params)
+    elif node_type == 'sql':
+        key.append((node_type, node.value))
+        params.extend(node.params)
+    elif node_type == 'entity':
+        key.append((node_type, node.path))
+    elif node_type is not None:
+        # subqueries and other rarely used nodes are compiled as usual
+        raise _Unsupported
+    elif isinstance(node, (list, tuple)):
+        key.append(('list', len(node)))
+        for item in node:
+            _walk(item, conv, key, params)
+    elif isinstance(node, peewee.Model):
+        key.append('model')
+        to_field = getattr(conv, 'to_field', None)
+        if to_field is not None and not isinstance(to_field, peewee.ForeignKeyField):
+            params.append(to_field.db_value(getattr(node, to_field.name)))
+        else:
+            params.append(node._get_pk_value())
+    elif inspect.isclass(node) or isinstance(node, peewee.ModelAlias):
+        raise _Unsupported
+    else:
+        key.append(None)
+        params.append(conv.db_value(node) if conv else node)
+        return
+    if isinstance(node, peewee.Node):
+        key.append((node._negated, node._alias, node._ordering))
+
+
+def _walk_joins(query, key, params):
+    # same depth-first order of joins as QueryCompiler.generate_joins()
+    joins = query._joins
+    seen = set()
+    models = [query.model_class]
+    while models:
+        model = models.pop()
+        if model not in joins or model in seen:
+            continue
+        seen.add(model)
+        for join in joins[model]:
+            dest = join.dest
+            if not inspect.isclass(dest):
+                raise _Unsupported
+            key.append(('join', model, dest, join.join_type))
+            on = join.on
+            if isinstance(on, (peewee.Expression, peewee.Func, peewee.Clause)):
+                _walk(on, None, key, params)
+            elif isinstance(on, peewee.Field) and inspect.isclass(on.model_class):
+                key.append((on.model_class, on.name))
+            elif on is None or isinstance(on, str):
+                key.append(on)
+            else:
+                raise _Unsupported
+            models.append(dest)
+
+
+def _select_shape(query, key, params):
+    if (
+        query._from is not None or
+        query._windows is not None or
+        query._distinct not in (True, False)
+    ):
+        raise _Unsupported
+    key.append((query._distinct, query._limit, query._offset, query._for_update))
+    for node in query._select:
+        _walk(node, None, key, params)
+    _walk_joins(query, key, params)
+    if query._where is not None:
+        _walk(query._where, None, key, params)
+    for node in query._group_by or ():
+        _walk(node, None, key, params)
+    if query._having:
+        _walk(query._having, None, key, params)
+    for node in query._order_by or ():
+        _walk(node, None, key, params)
+
+
+def _update_shape(query, key, params):
+    key.append(query._on_conflict)
+    fields = sorted(query._update.items(), key=lambda item: item[0]._sort_key)
+    for field, value in fields:
+        key.append((field.model_class, field.name))
+        if isinstance(value, peewee.Model):
+            raise _Unsupported
+        if isinstance(value, peewee.Node):
+            _walk(value, None, key, params)
+        else:
+            key.append(None)
+            params.append(field.db_value(value))
+    _where_shape(query, key, params)
+
+
+def _where_shape(query, key, params):
+    if query._where:
+        _walk(query._where, None, key, params)
+    key.append(query._returning is not None)
+    for node in query._returning or ():
+        _walk(node, None, key, params)
+
+
+_shapes = {
+    peewee.SelectQuery: _select_shape,
+    peewee.UpdateQuery: _update_shape,
+    peewee.DeleteQuery: _where_shape,
+}
+
+
+def _shape(query):
+    if isinstance(query, peewee.CompoundSelect):
+        raise _Unsupported
+    for query_class, shape in _shapes.items():
+        if isinstance(query, query_class):
+            break
+    else:
+        raise _Unsupported
+    key = [type(query), query.model_class]
+    params = []
+    shape(query, key, params)
+    return tuple(key), params
+
+
+class SQLCache:
+    """
+    LRU of compiled SQL keyed by query structure, parameters of cached
+    statements are collected without compiling the query
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._statements = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def sql(self, query, compile):
+        try:
+            key, params = _shape(query)
+            sql = self._statements[key]
+        except _Unsupported:
+            return compile()
+        except KeyError:
+            pass
+        else:
+            self._statements.move_to_end(key)
+            self.hits += 1
+            return sql, params
+        self.misses += 1
+        sql, params = compile()
+        if len(self._statements) >= self.size:
+            self._statements.popitem(last=False)
+            self.evictions += 1
+        self._statements[key] = sql
+        return sql, params
+
+    def clear(self):
+        self._statements.clear()
+
+
+class StatementCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._names = itertools.count()
+        self._statements = weakref.WeakKeyDictionary()
+        self._unpreparable = collections.OrderedDict()
+
+    def __len__(self):
+        return sum(map(len, self._statements.values()))
+
+    def statement(self, connection, sql, params, in_transaction=False):
+        if not params or '%(' in sql or ';' in sql:
+            # multiple statements can't be prepared at once
+            return sql
+        if sql in self._unpreparable:
+            return sql
+        statements = self._statements.setdefault(
+            connection,
+            collections.OrderedDict(),
+        )
+        try:
+            name, params_count = statements[sql]
+        except KeyError:
+            pass
+        else:
+            statements.move_to_end(sql)
+            self.hits += 1
+            return 'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * params_count))
+        self.misses += 1
+        name = 'ormageddon_statement_%d' % next(self._names)
+        positional_sql, params_count = _positional(sql)
+        commands = []
+        if len(statements) >= self.size:
+            _, (evicted, _) = statements.popitem(last=False)
+            self.evictions += 1
+            commands.append('DEALLOCATE %s' % evicted)
+        statements[sql] = name, params_count
+        # preparing and executing statement costs single round trip
+        commands.append('PREPARE %s AS %s' % (name, positional_sql))
+        if in_transaction:
+            # failed PREPARE must not abort the whole transaction
+            commands.insert(0, 'SAVEPOINT %s' % SAVEPOINT)
+            commands.append('RELEASE SAVEPOINT %s' % SAVEPOINT)
+        commands.append('EXECUTE %s (%s)' % (name, ', '.join(['%s'] * params_count)))
+        return '; '.join(commands)
+
+    def discard(self, connection):
+        self._statements.pop(connection, None)
+
+    def unpreparable(self, sql):
+        # server can't infer types of some parameters without values,
+        # e.g. of `SELECT $1`, such statements are always sent as is
+        self._unpreparable[sql] = None
+        if len(self._unpreparable) > self.size:
+            self._unpreparable.popitem(last=False)
@@ -1,22 +1,16 @@
-import inspect
-
 import peewee
 
+from ormageddon.loader import BatchLoader
+
 __all__ = [
     'PrimaryKeyField',
     'IntegerField',
+    'ForeignKeyField',
 ]
 
 
 class Field(peewee.Field):
-
-    async def async_python_value(self, value):
-        return super().python_value(await value)
-
-    def python_value(self, value):
-        if inspect.isawaitable(value):
-            return self.async_python_value(value)
-        return super().python_value(value)
+    pass
 
 
 class PrimaryKeyField(peewee.PrimaryKeyField, Field):
@@ -25,3 +19,35 @@ class PrimaryKeyField(peewee.PrimaryKeyField, Field):
 
 class IntegerField(peewee.IntegerField, Field):
     pass
+
+
+class RelationDescriptor(peewee.RelationDescriptor):
+
+    def __init__(self, field, rel_model):
+        super().__init__(field, rel_model)
+        self.loader = BatchLoader(field.to_field)
+
+    async def get_object_or_id(self, instance):
+        if self.att_name in instance._obj_cache:
+            return instance._obj_cache[self.att_name]
+        rel_id = instance._data.get(self.att_name)
+        if rel_id is not None:
+            identity_map = self.rel_model._meta.database.get_identity_map()
+            obj = None
+            if identity_map is not None and self.field.to_field.primary_key:
+                obj = identity_map.get(self.rel_model, rel_id)
+            if obj is None:
+                obj = await self.loader.load(rel_id)
+                if identity_map is not None:
+                    obj = identity_map.setdefault(obj)
+            instance._obj_cache.setdefault(self.att_name, obj)
+            return instance._obj_cache[self.att_name]
+        elif not self.field.null:
+            raise self.rel_model.DoesNotExist
+        return rel_id
+
+
+class ForeignKeyField(peewee.ForeignKeyField, Field):
+
+    def _get_descriptor(self):
+        return RelationDescriptor(self, self.rel_model)
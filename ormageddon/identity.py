@@ -0,0 +1,53 @@
+__all__ = [
+    'IdentityMap',
+    'IdentityMapContext',
+]
+
+
+class IdentityMap:
+
+    def __init__(self):
+        self._instances = {}
+
+    def get(self, model_class, pk_value):
+        return self._instances.get((model_class, pk_value))
+
+    def add(self, instance):
+        pk_value = instance._get_pk_value()
+        if pk_value is not None:
+            self._instances[type(instance), pk_value] = instance
+
+    def setdefault(self, instance):
+        pk_value = instance._get_pk_value()
+        if pk_value is None:
+            return instance
+        return self._instances.setdefault((type(instance), pk_value), instance)
+
+    def discard(self, model_class, pk_value):
+        self._instances.pop((model_class, pk_value), None)
+
+    def discard_model(self, model_class):
+        for key in [key for key in self._instances if key[0] is model_class]:
+            del self._instances[key]
+
+    def clear(self):
+        self._instances.clear()
+
+
+class IdentityMapContext:
+
+    def __init__(self, db):
+        self.db = db
+        self._identity_map = None
+
+    async def __aenter__(self):
+        identity_map = self.db.get_identity_map()
+        if identity_map is None:
+            identity_map = self._identity_map = IdentityMap()
+            self.db.set_identity_map(identity_map)
+        return identity_map
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._identity_map is not None:
+            self.db.set_identity_map(None)
+            self._identity_map = None
@@ -0,0 +1,39 @@
+import logging
+
+__all__ = [
+    'Instrument',
+    'SlowQueryLog',
+]
+
+
+class Instrument:
+
+    def before_execute(self, sql, params, model):
+        pass
+
+    def after_execute(self, sql, params, model, duration, rowcount, error):
+        pass
+
+    def connection_acquired(self, connection, wait):
+        pass
+
+    def connection_released(self, connection):
+        pass
+
+
+class SlowQueryLog(Instrument):
+
+    def __init__(self, threshold, logger=None):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger('ormageddon.slow_queries')
+
+    def after_execute(self, sql, params, model, duration, rowcount, error):
+        if duration >= self.threshold:
+            self.logger.warning(
+                'Slow query (%.3fs, model: %s, rows: %s): %s; params: %r',
+                duration,
+                model and model.__name__,
+                rowcount,
+                sql,
+                params,
+            )
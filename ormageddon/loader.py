@@ -0,0 +1,82 @@
+import asyncio
+
+__all__ = [
+    'BatchLoader',
+]
+
+
+class BatchLoader:
+    """
+    Merges lookups made during the same event loop iteration into single
+    query executed by separate task. That task takes its own pooled
+    connection, so connection pinned by `connection()` context of callers
+    is not used, and runs with the most urgent priority among callers
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._pending = {}
+        self._priority = None
+
+    @property
+    def database(self):
+        return self.field.model_class._meta.database
+
+    def load(self, key):
+        database = self.database
+        if database.transaction_depth():
+            # rows must be read by the transaction connection
+            return self._get(key)
+        future = self._pending.get(key)
+        if future is None:
+            if not self._pending:
+                database.loop.call_soon(self._dispatch)
+            future = self._pending[key] = asyncio.Future(loop=database.loop)
+        priority = database.get_priority()
+        priorities = database.priorities
+        if self._priority is None or priorities[priority] < priorities[self._priority]:
+            self._priority = priority
+        return self._instance(future)
+
+    async def _get(self, key):
+        return await self.field.model_class.get(self.field == key)
+
+    async def _instance(self, future):
+        # cancellation of one caller must not affect others waiting
+        # for the same row
+        data = await asyncio.shield(future, loop=self.database.loop)
+        # every caller gets its own instance, callers may be unrelated
+        # tasks modifying it independently
+        instance = self.field.model_class()
+        instance._data.update(data)
+        instance._prepare_instance()
+        return instance
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        priority, self._priority = self._priority, None
+        asyncio.ensure_future(
+            self._load(pending, priority),
+            loop=self.database.loop,
+        )
+
+    async def _load(self, pending, priority):
+        model_class = self.field.model_class
+        try:
+            query = model_class.select().where(self.field << list(pending))
+            async with self.database.priority(priority):
+                async for instance in query.iterator():
+                    future = pending.pop(instance._data[self.field.name], None)
+                    if future is not None and not future.done():
+                        future.set_result(instance._data)
+        except Exception as error:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for key, future in pending.items():
+                if not future.done():
+                    future.set_exception(model_class.DoesNotExist(
+                        'Instance matching query does not exist:\n%s = %r'
+                        % (self.field.name, key)
+                    ))
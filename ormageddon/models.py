@@ -1,13 +1,14 @@
-import contextlib
-import inspect
+import functools
+import itertools
+import operator
 
 import peewee
 
 from ormageddon.query import *
-from ormageddon.utils import patch
 
 __all__ = [
     'Model',
+    'prefetch',
 ]
 
 
@@ -25,6 +26,18 @@ class Model(peewee.Model):
         query.__class__ = InsertQuery
         return query
 
+    @classmethod
+    def insert_many(cls, rows, validate_fields=True, batch_size=None):
+        query = super().insert_many(rows, validate_fields=validate_fields)
+        query.__class__ = InsertQuery
+        return query.return_id_list().batch_size(batch_size)
+
+    @classmethod
+    def insert_from(cls, fields, query):
+        query = super().insert_from(fields, query)
+        query.__class__ = InsertQuery
+        return query
+
     @classmethod
     def update(cls, *args, **kwargs):
         query = super().update(*args, **kwargs)
@@ -35,26 +48,187 @@ class Model(peewee.Model):
     def delete(cls):
         return DeleteQuery(cls)
 
-    async def delete_instance(self, recursive=False, delete_nullable=False):
-        def executor(execute):
-            def _execute(query):
-                queries_to_execute.append(execute(query))
-            return _execute
-        queries_to_execute = []
-        with contextlib.ExitStack() as exit_stack:
-            exit_stack.enter_context(patch(DeleteQuery, 'execute', executor(DeleteQuery.execute)))
-            exit_stack.enter_context(patch(UpdateQuery, 'execute', executor(UpdateQuery.execute)))
-            super().delete_instance(recursive=recursive, delete_nullable=delete_nullable)
-        for future in queries_to_execute:
-            result = await future
-        return result
+    @classmethod
+    async def _bulk_update(cls, instances, fields, batch_size):
+        rows = 0
+        while True:
+            batch = list(itertools.islice(instances, batch_size))
+            if not batch:
+                break
+            rows += await BulkUpdateQuery(cls, batch, fields).execute()
+            for instance in batch:
+                instance._dirty.difference_update(field.name for field in fields)
+        return rows
+
+    @classmethod
+    async def bulk_update(cls, instances, fields, batch_size=None):
+        database = cls._meta.database
+        batch_size = batch_size or database.update_batch_size
+        fields = [
+            cls._meta.fields[field] if isinstance(field, str) else field
+            for field in fields
+        ]
+        instances = iter(instances)
+        async with database.transaction():
+            return await cls._bulk_update(instances, fields, batch_size)
+
+    @classmethod
+    def _pk_expr_many(cls, instances):
+        if len(instances) == 1:
+            return instances[0]._pk_expr()
+        if cls._meta.composite_key:
+            return functools.reduce(
+                operator.or_,
+                [instance._pk_expr() for instance in instances],
+            )
+        return cls._meta.primary_key << [
+            instance._get_pk_value() for instance in instances
+        ]
+
+    @classmethod
+    def _dependencies(cls, instances, search_nullable=False):
+        query = cls.select().where(cls._pk_expr_many(instances))
+        stack = [(cls, query)]
+        seen = set()
+        while stack:
+            klass, query = stack.pop()
+            if klass in seen:
+                continue
+            seen.add(klass)
+            for fk in klass._meta.reverse_rel.values():
+                rel_model = fk.model_class
+                if fk.rel_model is cls:
+                    node = fk << [
+                        instance._data[fk.to_field.name]
+                        for instance in instances
+                    ]
+                else:
+                    node = fk << query
+                subquery = rel_model.select().where(node)
+                if not fk.null or search_nullable:
+                    stack.append((rel_model, subquery))
+                yield node, fk
+
+    @classmethod
+    async def _execute_script(cls, queries):
+        sql = []
+        params = []
+        for query in queries:
+            query._invalidate_identity_map()
+            query_sql, query_params = query.sql()
+            sql.append(query_sql)
+            params.extend(query_params)
+        # statements sent at once are executed by the server in implicit
+        # transaction unless explicit one is already started
+        cursor = await cls._meta.database.execute_sql('; '.join(sql), params)
+        try:
+            return cursor.rowcount
+        finally:
+            cursor.close()
+            transaction = cls._meta.database.get_transaction()
+            for query in queries:
+                query._invalidate_result_cache(transaction)
+
+    @classmethod
+    async def delete_many(cls, instances, recursive=False, delete_nullable=False):
+        instances = list(instances)
+        if not instances:
+            return 0
+        queries = []
+        if recursive:
+            dependencies = cls._dependencies(instances, delete_nullable)
+            for node, fk in reversed(list(dependencies)):
+                model = fk.model_class
+                if fk.null and not delete_nullable:
+                    queries.append(model.update(**{fk.name: None}).where(node))
+                else:
+                    queries.append(model.delete().where(node))
+        queries.append(cls.delete().where(cls._pk_expr_many(instances)))
+        return await cls._execute_script(queries)
+
+    def delete_instance(self, recursive=False, delete_nullable=False):
+        return self.delete_many(
+            [self],
+            recursive=recursive,
+            delete_nullable=delete_nullable,
+        )
+
+    def _populate_unsaved_relations(self, field_dict):
+        for key in self._meta.rel:
+            conditions = (
+                key in self._dirty and
+                key in field_dict and
+                field_dict[key] is None and
+                self._obj_cache.get(key) is not None
+            )
+            if conditions:
+                setattr(self, key, self._obj_cache[key])
+                field_dict[key] = self._data[key]
 
     async def save(self, force_insert=False, only=None):
-        result = super().save(force_insert=force_insert, only=only)
+        field_dict = dict(self._data)
         if self._meta.primary_key is not False:
+            pk_field = self._meta.primary_key
             pk_value = self._get_pk_value()
-            if inspect.isawaitable(pk_value):
-                self._set_pk_value(await pk_value)
-        if inspect.isawaitable(result):
-            return await result
-        return result
+        else:
+            pk_field = pk_value = None
+        if only:
+            field_dict = self._prune_fields(field_dict, only)
+        elif self._meta.only_save_dirty and not force_insert:
+            field_dict = self._prune_fields(field_dict, self.dirty_fields)
+            if not field_dict:
+                self._dirty.clear()
+                return False
+
+        self._populate_unsaved_relations(field_dict)
+        if pk_value is not None and not force_insert:
+            if self._meta.composite_key:
+                for pk_part_name in pk_field.field_names:
+                    field_dict.pop(pk_part_name, None)
+            else:
+                field_dict.pop(pk_field.name, None)
+            query = self.update(**field_dict).where(self._pk_expr())
+            rows = await query.execute()
+        elif pk_field is None:
+            await self.insert(**field_dict).execute()
+            rows = 1
+        else:
+            pk_from_cursor = await self.insert(**field_dict).execute()
+            if pk_from_cursor is not None:
+                pk_value = pk_from_cursor
+            self._set_pk_value(pk_value)
+            rows = 1
+        self._dirty.clear()
+        identity_map = self._meta.database.get_identity_map()
+        if identity_map is not None:
+            identity_map.add(self)
+        return rows
+
+
+async def prefetch(sq, *subqueries):
+    if not subqueries:
+        return sq
+    fixed_queries = peewee.prefetch_add_subquery(sq, subqueries)
+
+    deps = {}
+    rel_map = {}
+    for prefetch_result in reversed(fixed_queries):
+        query_model = prefetch_result.model
+        if prefetch_result.fields:
+            for rel_model in prefetch_result.rel_models:
+                rel_map.setdefault(rel_model, [])
+                rel_map[rel_model].append(prefetch_result)
+
+        deps[query_model] = {}
+        id_map = deps[query_model]
+        has_relations = bool(rel_map.get(query_model))
+
+        async for instance in prefetch_result.query:
+            if prefetch_result.fields:
+                prefetch_result.store_instance(instance, id_map)
+
+            if has_relations:
+                for rel in rel_map[query_model]:
+                    rel.populate_instance(instance, deps[rel.model])
+
+    return prefetch_result.query
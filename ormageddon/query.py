@@ -1,85 +1,306 @@
 import asyncio
 import contextlib
-import functools
-import inspect
+import itertools
+import operator
 
 import peewee
 
-from ormageddon.utils import patch, map_async, ensure_iterables
+from ormageddon.utils import patch
+from ormageddon.wrappers import RESULTS_NAMEDTUPLES
 
 __all__ = [
     'SelectQuery',
     'UpdateQuery',
     'InsertQuery',
     'DeleteQuery',
+    'BulkUpdateQuery',
 ]
 
 
-def _map(callback, *iterables, loop=None):
-    if any(map(inspect.isawaitable, iterables)):
-        return map_async(callback, *iterables, loop=loop)
-    return map(callback, *iterables)
-
-
-def _zip(*iterables, loop=None):
-    assert not all(map(inspect.isawaitable, iterables))
-    return zip(*ensure_iterables(*iterables, loop=loop))
-
-
 class _QueryExecutor:
 
-    __slots__ = ('cursor', 'execute', 'loop')
+    __slots__ = ('cursor', 'execute', 'loop', 'callback')
 
-    def __init__(self, execute, loop=None):
+    def __init__(self, execute, loop=None, callback=None):
         self.cursor = None
         self.execute = execute
         self.loop = loop
+        self.callback = callback
 
     def __call__(self):
         self.cursor = asyncio.ensure_future(
             self.execute(),
             loop=self.loop,
         )
+        if self.callback is not None:
+            self.cursor.add_done_callback(self.callback)
         return self
 
+    def __await__(self):
+        return self.cursor.__await__()
+
     async def fetchone(self):
-        return await (await self.cursor).fetchone()
+        cursor = await self.cursor
+        try:
+            return await cursor.fetchone()
+        finally:
+            cursor.close()
 
     async def fetchall(self):
-        return await (await self.cursor).fetchall()
+        cursor = await self.cursor
+        try:
+            return await cursor.fetchall()
+        finally:
+            cursor.close()
 
     @property
     async def rowcount(self):
-        return (await self.cursor).rowcount
+        cursor = await self.cursor
+        rowcount = cursor.rowcount
+        cursor.close()
+        return rowcount
+
+    async def close(self):
+        (await self.cursor).close()
+
+
+class _KeysetPageIterator:
+
+    def __init__(self, query, size, key, descending=False):
+        self.query = query
+        self.size = size
+        self.key = key
+        self.descending = descending
+        self._fields = query._keyset_fields(key)
+        self._getters = [self._getter(field) for field in self._fields]
+        self._last = None
+        self._done = False
+
+    def _getter(self, field):
+        query = self.query
+        if query._tuples:
+            for index, column in enumerate(query._select):
+                if column is field:
+                    return operator.itemgetter(index)
+            raise ValueError(
+                'Keyset pagination requires %s to be selected' % field.name
+            )
+        if query._dicts:
+            return operator.itemgetter(field.name)
+        return operator.attrgetter(field.name)
+
+    def _key_value(self, row):
+        values = tuple(getter(row) for getter in self._getters)
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    async def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        page = []
+        query = self.query.after(
+            self._last,
+            size=self.size,
+            key=self.key,
+            descending=self.descending,
+        )
+        async for row in query:
+            page.append(row)
+        if len(page) < self.size:
+            self._done = True
+        if not page:
+            raise StopAsyncIteration
+        self._last = self._key_value(page[-1])
+        return page
+
+
+async def _fetchone(cursor):
+    cursor = await cursor
+    try:
+        return await cursor.fetchone()
+    finally:
+        cursor.close()
 
 
 class Query(peewee.Query):
 
-    def scalar(self, as_tuple=False, convert=False):
-        pass  # TODO
+    _timeout = None
+
+    def _clone_attributes(self, query):
+        query = super()._clone_attributes(query)
+        query._timeout = self._timeout
+        return query
+
+    @peewee.returns_clone
+    def timeout(self, timeout):
+        self._timeout = timeout
+
+    def _pk_lookup_value(self):
+        where = self._where
+        if isinstance(where, peewee.Expression) and where.op == peewee.OP.EQ:
+            pk_lookup = (
+                where.lhs is self.model_class._meta.primary_key and
+                not isinstance(where.rhs, peewee.Node)
+            )
+            if pk_lookup:
+                return where.rhs
+
+    def _invalidate_identity_map(self):
+        identity_map = self.database.get_identity_map()
+        if identity_map is not None:
+            pk_value = self._pk_lookup_value()
+            if pk_value is None:
+                identity_map.discard_model(self.model_class)
+            else:
+                identity_map.discard(self.model_class, pk_value)
+
+    def _invalidate_result_cache(self, transaction):
+        table = self.model_class._meta.db_table
+        if transaction:
+            transaction.written_tables.add(table)
+        else:
+            self.database.result_cache.invalidate(table)
+
+    def _executor(self):
+        # done callback is called outside of any task, so transaction of
+        # the current one is looked up in advance
+        transaction = self.database.get_transaction()
+        return _QueryExecutor(
+            self._execute,
+            loop=self.database.loop,
+            callback=lambda cursor: self._invalidate_result_cache(transaction),
+        )
+
+    def _execute(self):
+        sql, params = self.sql()
+        return self.database.execute_sql(
+            sql,
+            params,
+            self.require_commit,
+            model=self.model_class,
+            timeout=self._timeout,
+        )
+
+    def sql(self):
+        sql_cache = self.database.sql_cache
+        if sql_cache is None:
+            return super().sql()
+        return sql_cache.sql(self, super().sql)
+
+    async def scalar(self, as_tuple=False, convert=False):
+        if convert:
+            row = await self.tuples().first()
+        else:
+            row = await _fetchone(self._execute())
+        if row and not as_tuple:
+            return row[0]
+        return row
 
 
 class SelectQuery(Query, peewee.SelectQuery):
 
+    _namedtuples = False
+    _cache_ttl = None
+
+    def _clone_attributes(self, query):
+        query = super()._clone_attributes(query)
+        query._namedtuples = self._namedtuples
+        query._cache_ttl = self._cache_ttl
+        return query
+
+    @peewee.returns_clone
+    def namedtuples(self, namedtuples=True):
+        self._namedtuples = namedtuples
+
+    @peewee.returns_clone
+    def cached(self, ttl=60):
+        self._cache_ttl = ttl
+
+    def _tables(self):
+        tables = {self.model_class._meta.db_table}
+        for joins in self._joins.values():
+            for join in joins:
+                # destination may be model, model alias or subquery
+                dest = getattr(join.dest, 'model_class', join.dest)
+                tables.add(dest._meta.db_table)
+        return frozenset(tables)
+
+    def _execute(self):
+        sql, params = self.sql()
+        if self._cache_ttl is None:
+            return self.database.execute_sql(
+                sql,
+                params,
+                self.require_commit,
+                read_only=not self._for_update[0],
+                model=self.model_class,
+                timeout=self._timeout,
+            )
+        return self.database.execute_sql_cached(
+            sql,
+            params,
+            self._tables(),
+            self._cache_ttl,
+            model=self.model_class,
+            timeout=self._timeout,
+        )
+
+    def _get_result_wrapper(self):
+        if self._namedtuples:
+            return self.database.get_result_wrapper(RESULTS_NAMEDTUPLES)
+        return super()._get_result_wrapper()
+
     def __aiter__(self):
         return self.execute().__aiter__()
 
     async def _first_result(self):
-        async_iterator = await self.__aiter__()
-        return await async_iterator.__anext__()
+        result_wrapper = self.execute()
+        try:
+            async_iterator = await result_wrapper.__aiter__()
+            return await async_iterator.__anext__()
+        finally:
+            await result_wrapper.close()
+
+    def _selects_model(self):
+        return not (
+            self._explicit_selection or
+            self._tuples or
+            self._dicts or
+            self._namedtuples or
+            self._for_update[0] or
+            self._joins.get(self.model_class)
+        )
 
-    def get(self):
+    async def get(self):
+        identity_map = self.database.get_identity_map()
+        if identity_map is not None and self._selects_model():
+            pk_value = self._pk_lookup_value()
+            if pk_value is not None:
+                instance = identity_map.get(self.model_class, pk_value)
+                if instance is not None:
+                    return instance
+        else:
+            identity_map = None
         clone = self.clone()
         clone._limit = 1
         with contextlib.suppress(StopAsyncIteration):
-            return clone._first_result()
+            instance = await clone._first_result()
+            if identity_map is not None:
+                instance = identity_map.setdefault(instance)
+            return instance
         raise self.model_class.DoesNotExist(
             'Instance matching query does not exist:\nSQL: %s\nPARAMS: %s'
             % self.sql())
 
     async def first(self):
+        clone = self.clone()
+        clone._limit = 1
         with contextlib.suppress(StopAsyncIteration):
-            return await self._first_result()
+            return await clone._first_result()
 
     async def _getitem(self):
         with contextlib.suppress(StopAsyncIteration):
@@ -111,11 +332,84 @@ class SelectQuery(Query, peewee.SelectQuery):
     def __len__(self):
         raise NotImplementedError("Can't get len of the result in async mode")
 
-    def __await__(self):
-        return (yield from asyncio.ensure_future(
-            self.first(),
-            loop=self.database.loop,
+    def _keyset_fields(self, key=None):
+        primary_key = self.model_class._meta.primary_key
+        if key is None or key is primary_key:
+            return [primary_key]
+        # primary key breaks ties between rows having equal keys,
+        # otherwise such rows could be lost on page boundaries
+        return [key, primary_key]
+
+    def after(self, value, size=None, key=None, descending=False):
+        fields = self._keyset_fields(key)
+        query = self
+        if value is not None:
+            if len(fields) == 1:
+                lhs, rhs = fields[0], value
+            else:
+                lhs = peewee.EnclosedClause(*fields)
+                rhs = peewee.EnclosedClause(*value)
+            query = query.where(lhs < rhs if descending else lhs > rhs)
+        query = query.order_by(*[
+            field.desc() if descending else field for field in fields
+        ])
+        if size is not None:
+            query = query.limit(size)
+        return query
+
+    def pages(self, size, key=None, descending=False):
+        return _KeysetPageIterator(self, size, key, descending=descending)
+
+    async def count(self, clear_limit=False):
+        if self._distinct or self._group_by or self._limit or self._offset:
+            return await self.wrapped_count(clear_limit=clear_limit)
+        return await self.aggregate(convert=False) or 0
+
+    async def wrapped_count(self, clear_limit=False):
+        clone = self.order_by()
+        if clear_limit:
+            clone._limit = clone._offset = None
+        sql, params = clone.sql()
+        wrapped = 'SELECT COUNT(1) FROM (%s) AS wrapped_select' % sql
+        row = await _fetchone(self.database.execute_sql(
+            wrapped,
+            params,
+            read_only=True,
+            model=self.model_class,
+            timeout=self._timeout,
         ))
+        return row and row[0] or 0
+
+    async def exists(self):
+        clone = self.paginate(1, 1)
+        clone._select = [peewee.SQL('1')]
+        return bool(await clone.scalar())
+
+    def stream(self, batch_size=100):
+        sql, params = self.sql()
+        cursor = self.database.execute_sql_stream(
+            sql,
+            params,
+            batch_size=batch_size,
+            read_only=True,
+            timeout=self._timeout,
+        )
+        ResultWrapper = self._get_result_wrapper()
+        result_wrapper = ResultWrapper(
+            self.model_class,
+            cursor,
+            self.get_query_meta(),
+        )
+        return result_wrapper.iterator()
+
+    def iterator(self):
+        # rows are not kept by the query, so every iteration executes it
+        # again instead of reusing exhausted result wrapper
+        return self.clone().execute().iterator()
+
+    def __await__(self):
+        # awaited in the calling task to see its transaction and priority
+        return (yield from self.first().__await__())
 
 
 class UpdateQuery(Query, peewee.UpdateQuery):
@@ -130,39 +424,173 @@ class UpdateQuery(Query, peewee.UpdateQuery):
     def __iter__(self):
         raise NotImplementedError
 
+    def iterator(self):
+        return self.execute().iterator()
+
     def execute(self):
-        with patch(self, '_execute', _QueryExecutor(self._execute, loop=self.database.loop)):
+        self._invalidate_identity_map()
+        with patch(self, '_execute', self._executor()):
             return super().execute()
 
 
 class InsertQuery(Query, peewee.InsertQuery):
 
-    async def _insert_with_loop(self):
-        with patch(self, '_return_id_list', True):
-            id_list = await asyncio.gather(
-                *super()._insert_with_loop(),
-                loop=self.database.loop,
+    _batch_size = None
+
+    def _clone_attributes(self, query):
+        query = super()._clone_attributes(query)
+        query._batch_size = self._batch_size
+        return query
+
+    @peewee.returns_clone
+    def batch_size(self, batch_size=None):
+        self._batch_size = batch_size
+
+    async def _insert_many(self):
+        batch_size = self._batch_size or self.database.insert_batch_size
+        rows = iter(self._rows)
+        batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+        first = next(batches, [])
+        second = next(batches, None)
+        if second is None:
+            # single statement is atomic by itself
+            return await self._insert_batches([first])
+        # failed batch must not leave the preceding ones inserted
+        async with self.database.atomic():
+            return await self._insert_batches(
+                itertools.chain([first, second], batches),
             )
+
+    async def _insert_batches(self, batches):
+        id_list = []
+        for batch in batches:
+            query = self.clone()
+            query._rows = batch
+            result = await query._execute_insert()
+            if self._return_id_list:
+                id_list.extend(result)
         if self._return_id_list:
             return id_list
-        return id_list[-1]
+        return True
 
     async def execute(self):
-        loop = self.database.loop
-        with contextlib.ExitStack() as exit_stack:
-            exit_stack.enter_context(patch(self, '_execute', _QueryExecutor(self._execute, loop=loop)))
-            exit_stack.enter_context(patch(peewee, 'map', functools.partial(_map, loop=loop), map))
-            exit_stack.enter_context(patch(peewee, 'zip', functools.partial(_zip, loop=loop), zip))
-            result = super().execute()
-            if inspect.isawaitable(result):
-                return await result
-            elif isinstance(result, list):
-                return await asyncio.gather(*result, loop=loop)
-            return result
+        insert_many = (
+            self._is_multi_row_insert and
+            self._query is None and
+            self._returning is None
+        )
+        try:
+            if insert_many:
+                return await self._insert_many()
+            return await self._execute_insert()
+        finally:
+            self._invalidate_result_cache(self.database.get_transaction())
+
+    async def _execute_insert(self):
+        if self._returning is not None:
+            if self._qr is None:
+                self._execute_with_result_wrapper()
+            return self._qr
+        cursor = await self._execute()
+        try:
+            if not self._is_multi_row_insert:
+                pk_row = await cursor.fetchone()
+                meta = self.model_class._meta
+                clean_data = [
+                    field.python_value(column)
+                    for field, column
+                    in zip(meta.get_primary_key_fields(), pk_row)
+                ]
+                if meta.composite_key:
+                    return clean_data
+                return clean_data[0]
+            elif self._return_id_list:
+                return [row[0] for row in await cursor.fetchall()]
+            return True
+        finally:
+            cursor.close()
 
 
 class DeleteQuery(Query, peewee.DeleteQuery):
 
     def execute(self):
-        with patch(self, '_execute', _QueryExecutor(self._execute, loop=self.database.loop)):
+        self._invalidate_identity_map()
+        with patch(self, '_execute', self._executor()):
             return super().execute()
+
+
+class BulkUpdateQuery(Query):
+
+    alias = '_values'
+    _sql = None
+
+    def __init__(self, model_class, instances, fields):
+        super().__init__(model_class)
+        self._instances = instances
+        self._fields = fields
+
+    def _clone_attributes(self, query):
+        query = super()._clone_attributes(query)
+        query._instances = self._instances
+        query._fields = self._fields
+        return query
+
+    def _invalidate_identity_map(self):
+        identity_map = self.database.get_identity_map()
+        if identity_map is not None:
+            # instances held by the map may differ from the updated ones
+            for instance in self._instances:
+                identity_map.discard(self.model_class, instance._get_pk_value())
+
+    def _column_type(self, field):
+        db_field = field.get_db_field()
+        if db_field == 'primary_key':
+            # serial is not a type which values can be casted to
+            db_field = 'int'
+        return self.compiler().get_column_type(db_field)
+
+    def sql(self):
+        if self._sql is None:
+            meta = self.model_class._meta
+            assert not meta.composite_key, \
+                "Bulk update of models with composite key is not supported"
+            quote = self.compiler().quote
+            table = quote(meta.db_table)
+            alias = quote(self.alias)
+            pk_field = meta.primary_key
+            fields = [pk_field] + list(self._fields)
+            placeholder = self.database.interpolation
+            row_sql = '(%s)' % ', '.join(
+                'CAST(%s AS %s)' % (placeholder, self._column_type(field))
+                for field in fields
+            )
+            params = []
+            for instance in self._instances:
+                for field in fields:
+                    params.append(field.db_value(instance._data.get(field.name)))
+            self._sql = (
+                'UPDATE %s SET %s FROM (VALUES %s) AS %s (%s) WHERE %s.%s = %s.%s' % (
+                    table,
+                    ', '.join(
+                        '%s = %s.%s' % (
+                            quote(field.db_column),
+                            alias,
+                            quote(field.db_column),
+                        )
+                        for field in self._fields
+                    ),
+                    ', '.join([row_sql] * len(self._instances)),
+                    alias,
+                    ', '.join(quote(field.db_column) for field in fields),
+                    table,
+                    quote(pk_field.db_column),
+                    alias,
+                    quote(pk_field.db_column),
+                ),
+                params,
+            )
+        return self._sql
+
+    def execute(self):
+        self._invalidate_identity_map()
+        return self._executor()().rowcount
@@ -1,26 +1,99 @@
 import asyncio
+import functools
+import itertools
+import random
+
+from ormageddon.utils import force_future
 
 __all__ = [
+    'RETRYABLE_SQLSTATES',
+    'Savepoint',
     'Transaction',
     'TransactionContext',
 ]
 
+# serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = frozenset(['40001', '40P01'])
+
+
+def _sqlstate(error):
+    while error is not None:
+        pgcode = getattr(error, 'pgcode', None)
+        if pgcode:
+            return pgcode
+        # database errors are reraised by peewee from the driver ones
+        error = error.__cause__ or error.__context__
+
 
 class TransactionContext:
 
-    def __init__(self, transaction):
-        self.transaction = transaction
+    def __init__(self, db, retries=0, backoff=0.1, on_retry=None):
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.on_retry = on_retry
+        self.transaction = None
+        self.join = False
 
     async def __aenter__(self):
-        await self.transaction.begin()
-        return self.transaction
+        if self.retries or self.on_retry is not None:
+            # body of `async with` block can't be executed again
+            raise TypeError(
+                'retries and on_retry are supported only when transaction() '
+                'decorates coroutine function'
+            )
+        transaction = self.db.get_transaction()
+        self.join = transaction is not None
+        if not self.join:
+            transaction = self.db.get_transaction(create_if_not_exists=True)
+        self.transaction = transaction
+        try:
+            await transaction.begin()
+        except:
+            if not self.join:
+                self.db.pop_transaction()
+                transaction.restore_autocommit()
+            raise
+        return transaction
 
     def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.join:
+            # outer transaction decides whether to commit or not
+            return force_future(None, loop=self.db.loop)
         if exc_type is None:
             return self.transaction.commit(close_transaction=True)
         else:
             return self.transaction.rollback(close_transaction=True)
 
+    def retry_delay(self, attempt):
+        # jitter spreads competing transactions apart
+        return self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            attempt = 0
+            while True:
+                context = TransactionContext(self.db)
+                try:
+                    async with context:
+                        return await func(*args, **kwargs)
+                except Exception as error:
+                    retry = (
+                        not context.join and
+                        attempt < self.retries and
+                        _sqlstate(error) in RETRYABLE_SQLSTATES
+                    )
+                    if not retry:
+                        raise
+                    attempt += 1
+                    delay = self.retry_delay(attempt)
+                    if self.on_retry is not None:
+                        self.on_retry(error, attempt, delay)
+                    # connection is already given back to the pool
+                    await asyncio.sleep(delay, loop=self.db.loop)
+        return wrapper
+
 
 class Transaction:
 
@@ -29,11 +102,19 @@ class Transaction:
         self._autocommit = db.get_autocommit()
         self._connection = None
         self._starting = None
+        self.release_connection = True
+        self.written_tables = set()
 
     def begin(self):
         if not self._starting:
+            # pinned connection and priority belong to the calling task,
+            # not to the spawned one
             self._starting = asyncio.ensure_future(
-                self.db._begin(self),
+                self.db._begin(
+                    self,
+                    connection=self.db.get_task_connection(),
+                    priority=self.db.get_priority(),
+                ),
                 loop=self.db.loop,
             )
         return self._starting
@@ -63,3 +144,33 @@ class Transaction:
 
     def rollback(self, close_transaction=False):
         return self.db.rollback(close_transaction=close_transaction)
+
+
+class Savepoint:
+
+    _names = itertools.count()
+
+    def __init__(self, transaction):
+        self.transaction = transaction
+        self.name = 'ormageddon_savepoint_%d' % next(self._names)
+
+    async def __aenter__(self):
+        await self.transaction.begin()
+        await self.transaction.db.execute_transaction_statement(
+            'SAVEPOINT %s' % self.name,
+            self.transaction.connection,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            statement = 'RELEASE SAVEPOINT %s' % self.name
+        else:
+            # savepoint stays alive after rollback to it
+            statement = 'ROLLBACK TO SAVEPOINT {0}; RELEASE SAVEPOINT {0}'.format(
+                self.name,
+            )
+        await self.transaction.db.execute_transaction_statement(
+            statement,
+            self.transaction.connection,
+        )
@@ -1,3 +1,4 @@
+import collections
 import inspect
 
 import peewee
@@ -5,26 +6,30 @@ import peewee
 from ormageddon.utils import patch
 
 __all__ = [
+    'RESULTS_NAMEDTUPLES',
     'NaiveQueryResultWrapper',
+    'TuplesQueryResultWrapper',
+    'DictQueryResultWrapper',
+    'NamedTuplesQueryResultWrapper',
 ]
 
+RESULTS_NAMEDTUPLES = 6
+
 
 class ResultIterator(peewee.ResultIterator):
 
     async def __anext__(self):
-        try:
-            result = self.__next__()
-            if inspect.isawaitable(result):
-                result = await result
-                self.qrw._result_cache[-1] = result
-            return result
-        except StopAsyncIteration:
-            self.qrw._result_cache.pop()
-            self.qrw._ct -= 1
-            self._idx -= 1
-            raise
-        except StopIteration:
+        qrw = self.qrw
+        if self._idx < qrw._ct:
+            result = qrw._result_cache[self._idx]
+        elif not qrw._populated:
+            result = await qrw.iterate()
+            qrw._result_cache.append(result)
+            qrw._ct += 1
+        else:
             raise StopAsyncIteration
+        self._idx += 1
+        return result
 
 
 class QueryResultWrapper(peewee.QueryResultWrapper):
@@ -40,13 +45,32 @@ class QueryResultWrapper(peewee.QueryResultWrapper):
             if not getattr(self._cursor, 'name', None):
                 self._cursor.close()
             raise StopAsyncIteration
-        return super().process_row(row)
+        return self.convert_row(row)
+
+    def initialize(self, description):
+        super().initialize(description)
+        self.convert_row = self.row_converter()
+
+    def row_converter(self):
+        return super().process_row
 
     async def iterate(self):
         cursor = self._cursor = self._cursor or await self.cursor
         with patch(self, 'cursor', cursor):
             return await super().iterate()
 
+    async def close(self):
+        self._populated = True
+        if self._cursor is None:
+            if inspect.iscoroutine(self.cursor):
+                # statement was not sent yet
+                self.cursor.close()
+                return
+            self._cursor = await self.cursor
+        closing = self._cursor.close()
+        if inspect.isawaitable(closing):
+            await closing
+
     def __iter__(self):
         raise NotImplementedError
 
@@ -63,7 +87,7 @@ class QueryResultWrapper(peewee.QueryResultWrapper):
         return self.__next__()
 
     def iterator(self):
-        raise NotImplementedError
+        return UncachedResultIterator(self)
 
     @property
     async def count(self):
@@ -79,5 +103,100 @@ class QueryResultWrapper(peewee.QueryResultWrapper):
                 break
 
 
+class _NamedTuplesQueryResultWrapper(peewee.ExtQueryResultWrapper):
+
+    def initialize(self, description):
+        super().initialize(description)
+        self.row_class = collections.namedtuple(
+            'Row',
+            [column for _, column, _ in self.conv],
+            rename=True,
+        )
+
+    def process_row(self, row):
+        return self.row_class(*[func(row[i]) for i, _, func in self.conv])
+
+
 class NaiveQueryResultWrapper(QueryResultWrapper, peewee.NaiveQueryResultWrapper):
-    pass
+
+    def row_converter(self):
+        model = self.model
+        fields = model._meta.fields
+        data_columns = []
+        attr_columns = []
+        for i, column, func in self.conv:
+            if column in fields:
+                data_columns.append((i, column, func))
+            else:
+                attr_columns.append((i, column, func))
+
+        def convert_row(row):
+            instance = model()
+            data = instance._data
+            for i, column, func in data_columns:
+                data[column] = func(row[i])
+            for i, column, func in attr_columns:
+                setattr(instance, column, func(row[i]))
+            instance._prepare_instance()
+            return instance
+
+        return convert_row
+
+
+class TuplesQueryResultWrapper(QueryResultWrapper, peewee.TuplesQueryResultWrapper):
+
+    def row_converter(self):
+        funcs = [func for _, _, func in self.conv]
+
+        def convert_row(row):
+            return tuple([func(value) for func, value in zip(funcs, row)])
+
+        return convert_row
+
+
+class DictQueryResultWrapper(QueryResultWrapper, peewee.DictQueryResultWrapper):
+
+    def row_converter(self):
+        conv = list(self.conv)
+
+        def convert_row(row):
+            return {column: func(row[i]) for i, column, func in conv}
+
+        return convert_row
+
+
+class NamedTuplesQueryResultWrapper(QueryResultWrapper, _NamedTuplesQueryResultWrapper):
+
+    def row_converter(self):
+        row_class = self.row_class
+        funcs = [func for _, _, func in self.conv]
+
+        def convert_row(row):
+            return row_class(*[func(value) for func, value in zip(funcs, row)])
+
+        return convert_row
+
+
+class UncachedResultIterator:
+
+    def __init__(self, qrw):
+        self.qrw = qrw
+
+    async def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.qrw.iterate()
+        except StopAsyncIteration:
+            await self.close()
+            raise
+
+    async def close(self):
+        await self.qrw.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
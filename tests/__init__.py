@@ -0,0 +1,6 @@
+import sys
+
+# tasklocals keeps its state in task's __dict__ which C implementation
+# of tasks (Python 3.6+) doesn't have, pure Python one is used instead
+if 'asyncio' not in sys.modules:
+    sys.modules['_asyncio'] = None
@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import re
+import unittest
+
+import peewee
+
+import ormageddon
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.closed = False
+        self._rows = iter(())
+
+    async def execute(self, sql, params=None, timeout=None):
+        assert not self.closed, 'cursor is closed'
+        assert not self.connection.released, 'connection is released'
+        pool = self.connection.pool
+        pool.statements.append((sql, params))
+        pool.timeouts.append(timeout)
+        result = pool.handle(sql, params)
+        if asyncio.iscoroutine(result):
+            # slow "server" is interrupted by timeout like aiopg does
+            result = await asyncio.wait_for(result, timeout, loop=pool.loop)
+        description, rows, rowcount = result
+        # other tasks get their chance to run while "server" responds
+        await asyncio.sleep(0, loop=pool.loop)
+        self.description = description
+        self.rowcount = len(rows) if rowcount is None else rowcount
+        self._rows = iter(rows)
+
+    async def fetchone(self):
+        return next(self._rows, None)
+
+    async def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.released = False
+        self.closed = False
+        self.notifies = asyncio.Queue(loop=pool.loop)
+
+    async def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    """
+    Counts connections given out and taken back, answers statements
+    by handlers matched against SQL
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.acquired = 0
+        self.released = 0
+        self.statements = []
+        self.timeouts = []
+        self.handlers = []
+        self.minsize = 0
+        self.maxsize = 10
+        self.acquire_delay = 0
+        self._ids = itertools.count(1)
+
+    @property
+    def in_use(self):
+        return self.acquired - self.released
+
+    @property
+    def size(self):
+        return self.in_use
+
+    @property
+    def freesize(self):
+        return 0
+
+    def on(self, pattern, handler):
+        # handlers registered later take precedence
+        self.handlers.insert(0, (re.compile(pattern, re.I), handler))
+
+    def handle(self, sql, params):
+        for pattern, handler in self.handlers:
+            if pattern.search(sql):
+                return handler(sql, params)
+        if re.search(r'\bRETURNING\b', sql):
+            rows = [(next(self._ids),) for _ in range(_values_count(sql))]
+            return [('id',)], rows, None
+        return None, [], 1
+
+    async def acquire(self):
+        if self.acquire_delay:
+            await asyncio.sleep(self.acquire_delay, loop=self.loop)
+        self.acquired += 1
+        return FakeConnection(self)
+
+    def release(self, connection):
+        assert connection.pool is self, 'connection released to other pool'
+        assert not connection.released, 'connection released twice'
+        connection.released = True
+        self.released += 1
+        future = asyncio.Future(loop=self.loop)
+        future.set_result(None)
+        return future
+
+
+def _values_count(sql):
+    match = re.search(r'\bVALUES\s*(.*?)\s*RETURNING', sql, re.S | re.I)
+    if match is None:
+        return 1
+    return max(1, match.group(1).count('('))
+
+
+USERS = [(1, 'john', 30), (2, 'jane', 25), (3, 'jim', 40)]
+
+
+def rows(*columns, data=()):
+    def handler(sql, params, data=data):
+        return [(column,) for column in columns], list(data or ()), None
+    return handler
+
+
+class AsyncTestCase(unittest.TestCase):
+
+    loop_errors = None
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.pool = FakePool(self.loop)
+        self.db = self.create_database()
+        future = asyncio.Future(loop=self.loop)
+        future.set_result(self.pool)
+        self.db.__dict__['pool'] = future
+
+    def create_database(self, **kwargs):
+        return ormageddon.PostgresqlDatabase('test', loop=self.loop, **kwargs)
+
+    def tearDown(self):
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        if self.loop_errors is not None:
+            self.assertEqual([], self.loop_errors)
+
+    def catch_loop_errors(self):
+        # errors of callbacks and abandoned tasks fail the test
+        self.loop_errors = []
+        self.loop.set_exception_handler(
+            lambda loop, context: self.loop_errors.append(context),
+        )
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(
+            asyncio.ensure_future(coroutine, loop=self.loop),
+        )
+
+    def settle(self):
+        # let scheduled callbacks and tasks finish
+        for _ in range(5):
+            self.run_async(asyncio.sleep(0, loop=self.loop))
+
+    def assertNoLeaks(self):
+        self.settle()
+        self.assertEqual(self.pool.acquired, self.pool.released)
+
+    def serve_users(self, data=USERS):
+        self.pool.on(r'^SELECT .* FROM "user"', rows('id', 'name', 'age', data=data))
+
+    def create_model(self):
+
+        class User(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+                db_table = 'user'
+
+            id = ormageddon.PrimaryKeyField()
+            name = peewee.CharField(null=True)
+            age = ormageddon.IntegerField(null=True)
+
+        return User
@@ -0,0 +1,190 @@
+import asyncio
+
+import ormageddon
+
+from tests.base import AsyncTestCase
+
+
+class AdmissionTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+        self.catch_loop_errors()
+        self.admission = self.db.admission
+
+    def create_database(self, **kwargs):
+        return super().create_database(max_in_flight=1, **kwargs)
+
+    async def hold(self, released):
+        async with self.db.connection():
+            await released.wait()
+
+    async def prioritized(self, priority, coroutine_function):
+        async with self.db.priority(priority):
+            return await coroutine_function()
+
+    def run_queued(self, *calls):
+        # calls wait for the only slot held by another task and are
+        # admitted once it is released
+        async def test():
+            released = asyncio.Event(loop=self.loop)
+            holder = asyncio.ensure_future(self.hold(released), loop=self.loop)
+            await asyncio.sleep(0, loop=self.loop)
+            tasks = []
+            for priority, coroutine_function in calls:
+                tasks.append(asyncio.ensure_future(
+                    self.prioritized(priority, coroutine_function),
+                    loop=self.loop,
+                ))
+                # waiters are queued in the order of calls
+                for _ in range(5):
+                    await asyncio.sleep(0, loop=self.loop)
+            self.assertEqual(len(calls), self.admission.queued)
+            self.assertEqual([], self.pool.statements)
+            released.set()
+            await holder
+            return await asyncio.gather(
+                *tasks,
+                loop=self.loop,
+                return_exceptions=True,
+            )
+        return self.run_async(test())
+
+    def select(self, user_id):
+        return lambda: self.User.select().where(self.User.id == user_id).first()
+
+    def test_priority_order(self):
+        self.run_queued(
+            ('batch', self.select(1)),
+            ('default', self.select(2)),
+            ('interactive', self.select(3)),
+            ('default', self.select(4)),
+        )
+        self.assertEqual(
+            [3, 2, 4, 1],
+            [params[0] for sql, params in self.pool.statements],
+        )
+        self.assertNoLeaks()
+
+    def test_spawned_task_priority(self):
+        User = self.User
+
+        async def update():
+            await User.update(age=1).where(User.id == 1).execute()
+
+        async def save():
+            await User(id=2, name='jane').save()
+
+        async def delete():
+            await User.delete().where(User.id == 3).execute()
+
+        async def transaction():
+            async with self.db.transaction():
+                pass
+
+        self.run_queued(
+            ('default', self.select(4)),
+            ('interactive', update),
+            ('interactive', save),
+            ('interactive', delete),
+            ('interactive', transaction),
+        )
+        self.assertEqual(
+            ['UPDATE', 'UPDATE', 'DELETE', 'BEGIN', 'COMMIT', 'SELECT'],
+            [sql.split()[0] for sql, params in self.pool.statements],
+        )
+        self.assertNoLeaks()
+
+    def test_slot_handoff(self):
+        in_flight = []
+
+        def select(sql, params):
+            in_flight.append(self.admission.in_flight)
+            return None, [], 0
+
+        self.pool.on(r'^SELECT', select)
+        self.run_queued(*[('default', self.select(user_id)) for user_id in range(3)])
+        # released slot goes to the waiter as is, never exceeding the limit
+        self.assertEqual([1, 1, 1], in_flight)
+        self.assertEqual(
+            {'in_flight': 0, 'queued': 0, 'shed': 0, 'timeouts': 0},
+            self.admission.stats(),
+        )
+        self.assertNoLeaks()
+
+    def test_shedding(self):
+        self.admission.max_queue = 2
+
+        async def test():
+            released = asyncio.Event(loop=self.loop)
+            holder = asyncio.ensure_future(self.hold(released), loop=self.loop)
+            await asyncio.sleep(0, loop=self.loop)
+            waiters = [
+                asyncio.ensure_future(self.select(user_id)(), loop=self.loop)
+                for user_id in range(2)
+            ]
+            await asyncio.sleep(0, loop=self.loop)
+            with self.assertRaises(ormageddon.Overloaded):
+                await self.select(3)()
+            released.set()
+            await asyncio.gather(holder, *waiters, loop=self.loop)
+
+        self.run_async(test())
+        self.assertEqual(1, self.admission.shed)
+        self.assertEqual(0, self.admission.in_flight)
+        self.assertNoLeaks()
+
+    def test_acquire_timeout(self):
+        self.admission.timeout = 0.01
+
+        async def test():
+            released = asyncio.Event(loop=self.loop)
+            holder = asyncio.ensure_future(self.hold(released), loop=self.loop)
+            await asyncio.sleep(0, loop=self.loop)
+            with self.assertRaises(ormageddon.Overloaded):
+                await self.select(1)()
+            self.assertEqual(0, self.admission.queued)
+            released.set()
+            await holder
+            # slot of the timed out waiter is not lost
+            await self.select(2)()
+
+        self.run_async(test())
+        self.assertEqual(1, self.admission.timeouts)
+        self.assertEqual(0, self.admission.in_flight)
+        self.assertEqual(['SELECT'], [sql.split()[0] for sql, _ in self.pool.statements])
+        self.assertNoLeaks()
+
+    def test_listener_exempt(self):
+        async def test():
+            listener = asyncio.ensure_future(
+                self.db.listen_invalidations(),
+                loop=self.loop,
+            )
+            await asyncio.sleep(0, loop=self.loop)
+            self.assertEqual(0, self.admission.in_flight)
+            await self.select(1)()
+            listener.cancel()
+            await asyncio.wait([listener], loop=self.loop)
+
+        self.admission.timeout = 0.01
+        self.run_async(test())
+        self.assertEqual(0, self.admission.in_flight)
+        self.assertEqual(2, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_transaction_in_connection_context(self):
+        self.admission.timeout = 0.01
+
+        async def test():
+            async with self.db.connection():
+                # the only slot is already taken by the pinned connection
+                async with self.db.transaction():
+                    await self.select(1)()
+
+        self.run_async(test())
+        self.assertEqual(1, self.pool.acquired)
+        self.assertEqual(0, self.admission.timeouts)
+        self.assertNoLeaks()
@@ -0,0 +1,81 @@
+import psycopg2
+import peewee
+
+from tests.base import AsyncTestCase, rows
+
+
+class BatchTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.catch_loop_errors()
+        self.pool.on(r'^WITH', rows('a', 'b', 'c', 'd', data=[(2, 1, [7], [5, 6])]))
+
+    def add_queries(self, batch):
+        User = self.User
+        return [
+            batch.add(User.update(age=1).where(User.age > 20)),
+            batch.add(User.delete().where(User.id == 1)),
+            batch.add(User.insert(name='john')),
+            batch.add(
+                User.insert_many([{'name': 'jane'}, {'name': 'jim'}])
+                .return_id_list()
+            ),
+        ]
+
+    def test_single_statement(self):
+        async def test():
+            async with self.db.batch() as batch:
+                futures = self.add_queries(batch)
+            return [await future for future in futures]
+        self.assertEqual([2, 1, 7, [5, 6]], self.run_async(test()))
+        self.assertEqual(1, len(self.pool.statements))
+        sql, params = self.pool.statements[0]
+        self.assertEqual(
+            'WITH _batch_0 AS (UPDATE "user" SET "age" = %s '
+            'WHERE ("user"."age" > %s) RETURNING 1), '
+            '_batch_1 AS (DELETE FROM "user" '
+            'WHERE ("id" = %s) RETURNING 1), '
+            '_batch_2 AS (INSERT INTO "user" ("name") '
+            'VALUES (%s) RETURNING "id"), '
+            '_batch_3 AS (INSERT INTO "user" ("name") '
+            'VALUES (%s), (%s) RETURNING "id") '
+            'SELECT (SELECT count(*) FROM _batch_0), '
+            '(SELECT count(*) FROM _batch_1), '
+            '(SELECT array_agg("id" ORDER BY _ordinal) FROM '
+            '(SELECT "id", row_number() OVER () AS _ordinal FROM _batch_2) '
+            'AS _batch_2), '
+            '(SELECT array_agg("id" ORDER BY _ordinal) FROM '
+            '(SELECT "id", row_number() OVER () AS _ordinal FROM _batch_3) '
+            'AS _batch_3)',
+            sql,
+        )
+        self.assertEqual([1, 20, 1, 'john', 'jane', 'jim'], params)
+        self.assertNoLeaks()
+
+    def test_failed_statement(self):
+        def fail(sql, params):
+            raise psycopg2.IntegrityError('duplicate key value')
+
+        self.pool.on(r'^WITH', fail)
+
+        async def test():
+            with self.assertRaises(peewee.IntegrityError):
+                async with self.db.batch() as batch:
+                    futures = self.add_queries(batch)
+            for future in futures:
+                with self.assertRaises(peewee.IntegrityError):
+                    await future
+        self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_reads_rejected(self):
+        async def test():
+            async with self.db.batch() as batch:
+                with self.assertRaises(ValueError):
+                    batch.add(self.User.select())
+                with self.assertRaises(ValueError):
+                    batch.add(self.User.insert(name='john').returning(self.User.name))
+        self.run_async(test())
+        self.assertEqual([], self.pool.statements)
@@ -0,0 +1,44 @@
+from tests.base import AsyncTestCase
+
+
+class BulkUpdateTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+        self.catch_loop_errors()
+        self.pool.on(r'^UPDATE', lambda sql, params: (None, [], 2))
+
+    def users(self):
+        return [self.User(id=1, age=31), self.User(id=2, age=41)]
+
+    def test_identity_map(self):
+        User = self.User
+
+        async def test():
+            async with self.db.identity_map() as identity_map:
+                user = await User.get(User.id == 1)
+                self.assertEqual(2, await User.bulk_update(self.users(), [User.age]))
+                self.assertIsNone(identity_map.get(User, 1))
+                self.assertIsNone(identity_map.get(User, 2))
+                self.assertIsNot(user, await User.get(User.id == 1))
+        self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_result_cache(self):
+        User = self.User
+
+        async def read():
+            return [user async for user in User.select().cached()]
+
+        async def test():
+            await read()
+            await User.bulk_update(self.users(), [User.age])
+            await read()
+        self.run_async(test())
+        selects = [
+            sql for sql, _ in self.pool.statements if sql.startswith('SELECT')
+        ]
+        self.assertEqual(2, len(selects))
+        self.assertNoLeaks()
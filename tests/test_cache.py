@@ -0,0 +1,46 @@
+from tests.base import AsyncTestCase
+
+
+class ResultCacheTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+        self.catch_loop_errors()
+
+    def selects(self):
+        return len([
+            sql for sql, _ in self.pool.statements if sql.startswith('SELECT')
+        ])
+
+    async def read(self):
+        return [user async for user in self.User.select().cached()]
+
+    def test_invalidated_by_write(self):
+        User = self.User
+
+        async def test():
+            await self.read()
+            await self.read()
+            await User.update(age=1).where(User.id == 1).execute()
+            await self.read()
+        self.run_async(test())
+        self.assertEqual(2, self.selects())
+
+    def test_invalidated_after_commit(self):
+        User = self.User
+
+        async def test():
+            await self.read()
+            async with self.db.transaction():
+                await User.update(age=1).where(User.id == 1).execute()
+                await User.delete().where(User.id == 2).execute()
+                transaction = self.db.get_transaction()
+                self.assertEqual({'user'}, transaction.written_tables)
+                # not committed changes are not visible to others
+                self.assertEqual(1, len(self.db.result_cache))
+            await self.read()
+        self.run_async(test())
+        self.assertEqual(2, self.selects())
+        self.assertNoLeaks()
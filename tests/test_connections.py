@@ -0,0 +1,162 @@
+import gc
+
+import psycopg2
+import peewee
+
+from tests.base import AsyncTestCase
+
+
+def fail(sql, params):
+    raise psycopg2.ProgrammingError('syntax error')
+
+
+class ConnectionLeaksTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+
+    def test_exhausted_select(self):
+        async def test():
+            return [user async for user in self.User.select()]
+        self.assertEqual(3, len(self.run_async(test())))
+        self.assertNoLeaks()
+
+    def test_select_wrappers(self):
+        async def test():
+            for query in (
+                self.User.select().tuples(),
+                self.User.select().dicts(),
+                self.User.select().namedtuples(),
+            ):
+                async for _ in query:
+                    pass
+        self.run_async(test())
+        self.assertEqual(3, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_abandoned_select(self):
+        query = self.User.select()
+
+        async def test():
+            async for user in query:
+                return user
+        self.run_async(test())
+        self.settle()
+        # released without relying on garbage collection
+        self.assertEqual(self.pool.acquired, self.pool.released)
+
+    def test_closed_select(self):
+        async def test():
+            wrapper = self.User.select().execute()
+            await wrapper.close()
+        self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_first_and_get(self):
+        async def test():
+            await self.User.select().first()
+            await self.User.get(self.User.id == 1)
+            await self.User.select().scalar()
+        self.run_async(test())
+        self.assertEqual(3, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_writes(self):
+        async def test():
+            await self.User.insert(name='john').execute()
+            await self.User.insert_many([{'name': 'a'}, {'name': 'b'}]).execute()
+            await self.User.update(age=1).where(self.User.id == 1).execute()
+            await self.User.delete().where(self.User.id == 1).execute()
+            user = self.User(name='jane')
+            await user.save()
+            user.age = 20
+            await user.save()
+            await user.delete_instance()
+        self.run_async(test())
+        self.assertEqual(7, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_failed_statements(self):
+        self.pool.on(r'^(SELECT|UPDATE|INSERT)', fail)
+
+        async def test():
+            for query in (
+                self.User.select().first(),
+                self.User.update(age=1).execute(),
+                self.User.insert(name='john').execute(),
+            ):
+                with self.assertRaises(peewee.ProgrammingError):
+                    await query
+        self.run_async(test())
+        self.assertEqual(3, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_commit(self):
+        async def test():
+            async with self.db.transaction():
+                await self.User.insert(name='john').execute()
+                await self.User.select().first()
+        self.run_async(test())
+        self.assertEqual(1, self.pool.acquired)
+        self.assertEqual(
+            ['BEGIN', 'COMMIT'],
+            [self.pool.statements[0][0], self.pool.statements[-1][0]],
+        )
+        self.assertNoLeaks()
+
+    def test_rollback(self):
+        async def test():
+            async with self.db.transaction():
+                await self.User.insert(name='john').execute()
+                raise ValueError
+        with self.assertRaises(ValueError):
+            self.run_async(test())
+        self.assertEqual('ROLLBACK', self.pool.statements[-1][0])
+        self.assertNoLeaks()
+
+    def test_failed_commit(self):
+        self.pool.on(r'^COMMIT$', fail)
+
+        async def test():
+            async with self.db.transaction():
+                await self.User.insert(name='john').execute()
+        with self.assertRaises(peewee.ProgrammingError):
+            self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_failed_begin(self):
+        self.pool.on(r'^BEGIN$', fail)
+
+        async def test():
+            async with self.db.transaction():
+                pass
+        with self.assertRaises(psycopg2.ProgrammingError):
+            self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_connection_context(self):
+        async def test():
+            async with self.db.connection():
+                await self.User.select().first()
+                async for _ in self.User.select():
+                    break
+        self.run_async(test())
+        gc.collect()
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_transaction_in_connection_context(self):
+        async def test():
+            async with self.db.connection():
+                async with self.db.transaction():
+                    await self.User.select().first()
+                await self.User.select().first()
+        self.run_async(test())
+        self.assertEqual(1, self.pool.acquired)
+        self.assertEqual(
+            ['BEGIN', 'SELECT', 'COMMIT', 'SELECT'],
+            [sql.split()[0] for sql, params in self.pool.statements],
+        )
+        self.assertNoLeaks()
@@ -0,0 +1,131 @@
+"""
+Decode throughput of result wrappers, run as
+
+    python -m tests.test_decode [rows]
+
+prints rows per second of every wrapper's row converter next to generic
+peewee row processing. Test cases check converters on small amounts of rows.
+"""
+import datetime
+import sys
+import timeit
+
+import peewee
+
+import ormageddon
+from ormageddon.wrappers import QueryResultWrapper
+
+from tests.base import AsyncTestCase, rows
+
+ROW = (1, 'john', 30, datetime.datetime(2016, 1, 1), True)
+
+WRAPPERS = ['naive', 'tuples', 'dicts', 'namedtuples']
+
+
+class DecodeBenchmark(AsyncTestCase):
+    """
+    Fake cursor always answers with the same description, so converters
+    get initialized exactly as by real queries
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.Item = self.create_item_model()
+        self.pool.on(
+            r'^SELECT',
+            rows('id', 'name', 'value', 'created', 'active', data=[ROW]),
+        )
+
+    def runTest(self):
+        pass
+
+    def create_item_model(self):
+
+        class Item(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+                db_table = 'item'
+
+            id = ormageddon.PrimaryKeyField()
+            name = peewee.CharField()
+            value = ormageddon.IntegerField()
+            created = peewee.DateTimeField()
+            active = peewee.BooleanField()
+
+        return Item
+
+    def query(self, wrapper):
+        query = self.Item.select()
+        if wrapper != 'naive':
+            query = getattr(query, wrapper)()
+        return query
+
+    def wrapper(self, wrapper):
+        async def execute():
+            qrw = self.query(wrapper).execute()
+            await qrw.fill_cache()
+            return qrw
+        return self.run_async(execute())
+
+    def converters(self, wrapper):
+        qrw = self.wrapper(wrapper)
+        # converter is compared with the peewee's one it replaces
+        generic = super(QueryResultWrapper, qrw).process_row
+        return qrw.convert_row, generic
+
+    def measure(self, count):
+        data = [ROW] * count
+        results = {}
+        for wrapper in WRAPPERS:
+            converter, generic = self.converters(wrapper)
+            for name, func in (('converter', converter), ('generic', generic)):
+                duration = min(timeit.repeat(
+                    lambda: [func(row) for row in data],
+                    repeat=5,
+                    number=1,
+                ))
+                results[wrapper, name] = count / duration
+        return results
+
+
+class DecodeTestCase(DecodeBenchmark):
+
+    def test_converters(self):
+        for wrapper in WRAPPERS:
+            converter, generic = self.converters(wrapper)
+            expected = generic(ROW)
+            result = converter(ROW)
+            if wrapper == 'naive':
+                expected, result = expected._data, result._data
+            self.assertEqual(expected, result, wrapper)
+
+    def test_measure(self):
+        results = self.measure(10)
+        self.assertEqual(len(WRAPPERS) * 2, len(results))
+        self.assertTrue(all(rate > 0 for rate in results.values()))
+        self.assertNoLeaks()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    benchmark = DecodeBenchmark()
+    benchmark.setUp()
+    try:
+        results = benchmark.measure(count)
+    finally:
+        benchmark.tearDown()
+    print('%-12s %14s %14s %8s' % ('wrapper', 'converter', 'generic', 'ratio'))
+    for wrapper in WRAPPERS:
+        converter = results[wrapper, 'converter']
+        generic = results[wrapper, 'generic']
+        print('%-12s %10.0f r/s %10.0f r/s %7.2fx' % (
+            wrapper,
+            converter,
+            generic,
+            converter / generic,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import peewee
+
+import ormageddon
+
+from tests.base import AsyncTestCase
+
+
+class DeleteTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = User = self.create_model()
+
+        class Post(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+                db_table = 'post'
+
+            id = ormageddon.PrimaryKeyField()
+            user = ormageddon.ForeignKeyField(User, related_name='posts')
+            title = peewee.CharField()
+
+        class Comment(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+                db_table = 'comment'
+
+            id = ormageddon.PrimaryKeyField()
+            post = ormageddon.ForeignKeyField(Post, related_name='comments')
+
+        class Like(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+                db_table = 'like'
+
+            id = ormageddon.PrimaryKeyField()
+            user = ormageddon.ForeignKeyField(User, null=True, related_name='likes')
+
+        self.users = [User(id=1, name='john'), User(id=2, name='jane')]
+        for user in self.users:
+            user._dirty.clear()
+
+    def statements(self):
+        self.assertEqual(1, len(self.pool.statements))
+        sql, params = self.pool.statements[0]
+        return sql.split('; '), params
+
+    def test_delete_instance(self):
+        async def test():
+            await self.users[0].delete_instance()
+        self.run_async(test())
+        self.assertEqual(
+            (['DELETE FROM "user" WHERE ("id" = %s)'], [1]),
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_recursive(self):
+        async def test():
+            await self.users[0].delete_instance(recursive=True)
+        self.run_async(test())
+        # dependent rows go first, nullable references are cleared
+        self.assertEqual(
+            (
+                [
+                    'DELETE FROM "comment" WHERE ("post_id" IN ('
+                    'SELECT "t1"."id" FROM "post" AS t1 '
+                    'WHERE ("t1"."user_id" IN (%s))))',
+                    'UPDATE "like" SET "user_id" = %s '
+                    'WHERE ("like"."user_id" IN (%s))',
+                    'DELETE FROM "post" WHERE ("user_id" IN (%s))',
+                    'DELETE FROM "user" WHERE ("id" = %s)',
+                ],
+                [1, None, 1, 1, 1],
+            ),
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_recursive_nullable(self):
+        async def test():
+            await self.users[0].delete_instance(
+                recursive=True,
+                delete_nullable=True,
+            )
+        self.run_async(test())
+        self.assertEqual(
+            (
+                [
+                    'DELETE FROM "comment" WHERE ("post_id" IN ('
+                    'SELECT "t1"."id" FROM "post" AS t1 '
+                    'WHERE ("t1"."user_id" IN (%s))))',
+                    'DELETE FROM "like" WHERE ("user_id" IN (%s))',
+                    'DELETE FROM "post" WHERE ("user_id" IN (%s))',
+                    'DELETE FROM "user" WHERE ("id" = %s)',
+                ],
+                [1, 1, 1, 1],
+            ),
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_delete_many(self):
+        async def test():
+            await self.User.delete_many(self.users, recursive=True)
+        self.run_async(test())
+        # all instances are deleted by the same statements
+        self.assertEqual(
+            (
+                [
+                    'DELETE FROM "comment" WHERE ("post_id" IN ('
+                    'SELECT "t1"."id" FROM "post" AS t1 '
+                    'WHERE ("t1"."user_id" IN (%s, %s))))',
+                    'UPDATE "like" SET "user_id" = %s '
+                    'WHERE ("like"."user_id" IN (%s, %s))',
+                    'DELETE FROM "post" WHERE ("user_id" IN (%s, %s))',
+                    'DELETE FROM "user" WHERE ("id" IN (%s, %s))',
+                ],
+                [1, 2, None, 1, 2, 1, 2, 1, 2],
+            ),
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_delete_many_empty(self):
+        async def test():
+            return await self.User.delete_many([])
+        self.assertEqual(0, self.run_async(test()))
+        self.assertEqual([], self.pool.statements)
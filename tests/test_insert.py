@@ -0,0 +1,126 @@
+import asyncio
+
+import peewee
+import psycopg2
+
+from tests.base import AsyncTestCase, rows
+
+
+def returning_names(sql, params):
+    # every inserted row gets id equal to its name
+    return rows('id')(sql, params, [(int(name),) for name in params])
+
+
+class ConcurrentInsertTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.pool.on(r'^INSERT .* RETURNING', returning_names)
+
+    def gather(self, coroutines):
+        return self.run_async(asyncio.gather(*coroutines, loop=self.loop))
+
+    def test_insert(self):
+        results = self.gather(
+            self.User.insert(name=str(index)).execute()
+            for index in range(100)
+        )
+        self.assertEqual(list(range(100)), results)
+        self.assertNoLeaks()
+
+    def test_insert_many(self):
+        results = self.gather(
+            self.User.insert_many(
+                [{'name': str(index * 10 + row)} for row in range(10)]
+            ).return_id_list().execute()
+            for index in range(50)
+        )
+        self.assertEqual(
+            [list(range(index * 10, index * 10 + 10)) for index in range(50)],
+            results,
+        )
+        self.assertNoLeaks()
+
+    def test_save(self):
+        users = [self.User(name=str(index)) for index in range(100)]
+        self.gather(user.save() for user in users)
+        self.assertEqual(
+            list(range(100)),
+            [user.id for user in users],
+        )
+        self.assertNoLeaks()
+
+
+class ChunkedInsertTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.pool.on(r'^INSERT .* RETURNING', self.insert)
+
+    def insert(self, sql, params):
+        if 'fail' in params:
+            raise psycopg2.IntegrityError('duplicate key value')
+        return returning_names(sql, params)
+
+    def insert_many(self, *names):
+        return self.User.insert_many(
+            [{'name': name} for name in names]
+        ).batch_size(2).return_id_list().execute()
+
+    def statements(self):
+        return [sql.split()[0] for sql, params in self.pool.statements]
+
+    def test_chunks(self):
+        async def test():
+            return await self.insert_many('1', '2', '3', '4', '5')
+        self.assertEqual([1, 2, 3, 4, 5], self.run_async(test()))
+        self.assertEqual(
+            ['BEGIN', 'INSERT', 'INSERT', 'INSERT', 'COMMIT'],
+            self.statements(),
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_single_chunk(self):
+        async def test():
+            return await self.insert_many('1', '2')
+        self.assertEqual([1, 2], self.run_async(test()))
+        self.assertEqual(['INSERT'], self.statements())
+        self.assertNoLeaks()
+
+    def test_failed_chunk(self):
+        async def test():
+            await self.insert_many('1', '2', '3', 'fail', '5')
+        with self.assertRaises(peewee.IntegrityError):
+            self.run_async(test())
+        # preceding chunks are rolled back along with the failed one
+        self.assertEqual(
+            ['BEGIN', 'INSERT', 'INSERT', 'ROLLBACK'],
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_failed_chunk_in_transaction(self):
+        async def test():
+            async with self.db.transaction():
+                with self.assertRaises(peewee.IntegrityError):
+                    await self.insert_many('1', '2', '3', 'fail')
+                await self.insert_many('3')
+        self.run_async(test())
+        self.assertEqual(
+            [
+                'BEGIN',
+                'SAVEPOINT',
+                'INSERT',
+                'INSERT',
+                'ROLLBACK',
+                'INSERT',
+                'COMMIT',
+            ],
+            self.statements(),
+        )
+        self.assertTrue(self.pool.statements[4][0].startswith('ROLLBACK TO SAVEPOINT'))
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
@@ -0,0 +1,52 @@
+import ormageddon
+
+from tests.base import AsyncTestCase
+
+
+class Recorder(ormageddon.Instrument):
+
+    def __init__(self):
+        self.durations = []
+        self.waits = []
+
+    def after_execute(self, sql, params, model, duration, rowcount, error):
+        self.durations.append(duration)
+
+    def connection_acquired(self, connection, wait):
+        self.waits.append(wait)
+
+
+class InstrumentationTestCase(AsyncTestCase):
+
+    def test_duration_excludes_connection_wait(self):
+        User = self.create_model()
+        recorder = Recorder()
+        self.db.add_instrument(recorder)
+        self.pool.acquire_delay = 0.05
+
+        async def test():
+            await User.update(age=1).execute()
+        self.run_async(test())
+        self.assertEqual(1, len(recorder.durations))
+        self.assertGreaterEqual(recorder.waits[0], 0.05)
+        self.assertLess(recorder.durations[0], 0.05)
+        self.assertNoLeaks()
+
+    def test_instrument_added_during_statement(self):
+        User = self.create_model()
+        recorder = Recorder()
+
+        def update(sql, params):
+            if recorder not in self.db.instruments:
+                self.db.add_instrument(recorder)
+            return None, [], 1
+
+        self.pool.on(r'^UPDATE', update)
+
+        async def test():
+            await User.update(age=1).execute()
+            await User.update(age=2).execute()
+        self.run_async(test())
+        # the first statement started before the instrument was added
+        self.assertEqual(1, len(recorder.durations))
+        self.assertNoLeaks()
@@ -0,0 +1,80 @@
+import re
+
+from tests.base import AsyncTestCase, rows
+
+USERS = [(index, 'user%d' % index, index // 3) for index in range(1, 11)]
+
+
+def select_users(sql, params):
+    # evaluates keyset condition and ordering of statements built by after()
+    if 'ORDER BY "t1"."age"' in sql:
+        position = (lambda user: (user[2], user[0]))
+    else:
+        position = (lambda user: (user[0],))
+    descending = 'DESC' in sql
+    data = sorted(USERS, key=position, reverse=descending)
+    if params:
+        key = tuple(params)
+        data = [
+            user for user in data
+            if (position(user) < key if descending else position(user) > key)
+        ]
+    limit = re.search(r'LIMIT (\d+)', sql)
+    if limit:
+        data = data[:int(limit.group(1))]
+    return rows('id', 'name', 'age')(sql, params, data)
+
+
+class KeysetPaginationTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.pool.on(r'^SELECT', select_users)
+
+    def walk(self, query, **kwargs):
+        async def walk():
+            pages = []
+            async for page in query.pages(size=4, **kwargs):
+                pages.append(page)
+            return pages
+        return self.run_async(walk())
+
+    def test_after_sql(self):
+        User = self.User
+        sql, params = User.select().after((1, 2), size=5, key=User.age).sql()
+        self.assertIn('(("t1"."age", "t1"."id") > (%s, %s))', sql)
+        self.assertIn('ORDER BY "t1"."age", "t1"."id"', sql)
+        self.assertEqual([1, 2], params)
+
+    def test_pages_by_primary_key(self):
+        pages = self.walk(self.User.select())
+        self.assertEqual(
+            [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]],
+            [[user.id for user in page] for page in pages],
+        )
+        self.assertNoLeaks()
+
+    def test_pages_by_non_unique_key(self):
+        User = self.User
+        for query, get_id in (
+            (User.select(), lambda row: row.id),
+            (User.select().tuples(), lambda row: row[0]),
+            (User.select().dicts(), lambda row: row['id']),
+            (User.select().namedtuples(), lambda row: row.id),
+        ):
+            pages = self.walk(query, key=User.age)
+            ids = [get_id(row) for page in pages for row in page]
+            self.assertEqual(sorted(ids), [user[0] for user in USERS])
+        self.assertNoLeaks()
+
+    def test_pages_descending(self):
+        User = self.User
+        pages = self.walk(User.select().tuples(), key=User.age, descending=True)
+        ids = [row[0] for page in pages for row in page]
+        self.assertEqual(list(range(10, 0, -1)), ids)
+
+    def test_key_not_selected(self):
+        User = self.User
+        with self.assertRaises(ValueError):
+            User.select(User.name).tuples().pages(size=4)
@@ -0,0 +1,77 @@
+import asyncio
+
+import peewee
+
+import ormageddon
+
+from tests.base import AsyncTestCase, rows
+
+
+class BatchLoaderTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = User = self.create_model()
+
+        class Post(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+
+            id = ormageddon.PrimaryKeyField()
+            user = ormageddon.ForeignKeyField(User)
+            title = peewee.CharField()
+
+        self.Post = Post
+        self.priorities = []
+        self.pool.on(r'^SELECT .* FROM "user"', self.select_users)
+
+    def select_users(self, sql, params):
+        self.priorities.append(self.db.get_priority())
+        data = [(user_id, 'user%d' % user_id, None) for user_id in params]
+        return rows('id', 'name', 'age')(sql, params, data)
+
+    def posts(self, *user_ids):
+        return [
+            self.Post(id=index, user=user_id, title='post')
+            for index, user_id in enumerate(user_ids)
+        ]
+
+    def gather(self, coroutines):
+        return self.run_async(asyncio.gather(*coroutines, loop=self.loop))
+
+    def test_single_query(self):
+        posts = self.posts(1, 2, 1)
+        users = self.gather(post.user for post in posts)
+        self.assertEqual([1, 2, 1], [user.id for user in users])
+        self.assertEqual(1, len(self.pool.statements))
+        self.assertNoLeaks()
+
+    def test_instance_per_caller(self):
+        posts = self.posts(1, 1)
+        first, second = self.gather(post.user for post in posts)
+        self.assertIsNot(first, second)
+        first.name = 'changed'
+        self.assertEqual('user1', second.name)
+        self.assertFalse(second.is_dirty())
+
+    def test_cancelled_caller(self):
+        posts = self.posts(1, 1)
+
+        async def test():
+            first = asyncio.ensure_future(posts[0].user, loop=self.loop)
+            second = asyncio.ensure_future(posts[1].user, loop=self.loop)
+            await asyncio.sleep(0, loop=self.loop)
+            first.cancel()
+            return await second
+        self.assertEqual(1, self.run_async(test()).id)
+
+    def test_priority(self):
+        posts = self.posts(1, 2)
+
+        async def load(post, priority):
+            async with self.db.priority(priority):
+                return await post.user
+
+        self.gather([load(posts[0], 'batch'), load(posts[1], 'interactive')])
+        self.assertEqual(['interactive'], self.priorities)
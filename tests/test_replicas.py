@@ -0,0 +1,101 @@
+import asyncio
+
+from tests.base import AsyncTestCase, FakePool, rows
+
+
+class ReplicaTestCase(AsyncTestCase):
+
+    replica_selection = 'round_robin'
+
+    def setUp(self):
+        super().setUp()
+        self.replicas = [FakePool(self.loop), FakePool(self.loop)]
+        futures = []
+        for pool in [self.pool] + self.replicas:
+            pool.on(
+                r'^(SELECT|BEGIN; DECLARE)',
+                rows('id', 'name', 'age', data=[(1, 'john', 30)]),
+            )
+        for pool in self.replicas:
+            future = asyncio.Future(loop=self.loop)
+            future.set_result(pool)
+            futures.append(future)
+        self.db.__dict__['replica_pools'] = futures
+        self.User = self.create_model()
+
+    def create_database(self, **kwargs):
+        return super().create_database(
+            replicas=[{'host': 'replica1'}, {'host': 'replica2'}],
+            replica_selection=self.replica_selection,
+            **kwargs
+        )
+
+    def statements(self, pool):
+        return [sql.split()[0] for sql, params in pool.statements]
+
+    def assertNoLeaks(self):
+        super().assertNoLeaks()
+        for pool in self.replicas:
+            self.assertEqual(pool.acquired, pool.released)
+
+    def test_reads_spread(self):
+        async def test():
+            for _ in range(4):
+                await self.User.select().first()
+            async with self.User.select().stream() as users:
+                async for _ in users:
+                    pass
+        self.run_async(test())
+        self.assertEqual([], self.pool.statements)
+        self.assertEqual([3, 2], [pool.acquired for pool in self.replicas])
+        self.assertNoLeaks()
+
+    def test_writes_on_primary(self):
+        async def test():
+            await self.User.update(age=1).execute()
+            await self.User.insert(name='john').execute()
+            await self.User.delete().execute()
+            user = self.User(name='jane')
+            await user.save()
+            await self.User.select().for_update().first()
+        self.run_async(test())
+        self.assertEqual(
+            ['UPDATE', 'INSERT', 'DELETE', 'INSERT', 'SELECT'],
+            self.statements(self.pool),
+        )
+        self.assertEqual([0, 0], [pool.acquired for pool in self.replicas])
+        self.assertNoLeaks()
+
+    def test_transaction_on_primary(self):
+        async def test():
+            async with self.db.transaction():
+                await self.User.select().first()
+                async for _ in self.User.select():
+                    pass
+        self.run_async(test())
+        self.assertEqual(
+            ['BEGIN', 'SELECT', 'SELECT', 'COMMIT'],
+            self.statements(self.pool),
+        )
+        self.assertEqual([0, 0], [pool.acquired for pool in self.replicas])
+        self.assertNoLeaks()
+
+
+class LeastLoadedReplicaTestCase(ReplicaTestCase):
+
+    replica_selection = 'least_loaded'
+
+    def test_reads_spread(self):
+        async def test():
+            # the first replica is busy with connection held here
+            connection = await self.db.get_conn(read_only=True)
+            for _ in range(3):
+                await self.User.select().first()
+            self.db.release_conn(connection)
+        self.run_async(test())
+        self.assertEqual([1, 3], [pool.acquired for pool in self.replicas])
+        self.assertEqual(
+            [[], ['SELECT'] * 3],
+            [self.statements(pool) for pool in self.replicas],
+        )
+        self.assertNoLeaks()
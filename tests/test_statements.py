@@ -0,0 +1,173 @@
+import itertools
+
+import psycopg2
+import peewee
+
+import ormageddon
+from ormageddon.utils import patch
+
+from tests.base import AsyncTestCase
+
+
+class IndeterminateDatatype(psycopg2.ProgrammingError):
+    pgcode = '42P18'
+
+
+def indeterminate_datatype(sql, params):
+    raise IndeterminateDatatype('could not determine data type of parameter $1')
+
+
+class SQLCacheTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+
+    def compile(self, query):
+        with patch(self.db, 'sql_cache', None):
+            return query.sql()
+
+    def assertCached(self, build):
+        cache = self.db.sql_cache
+        hits = cache.hits
+        for value in (1, 2):
+            query = build(value)
+            self.assertEqual(self.compile(query), query.sql())
+        self.assertEqual(hits + 1, cache.hits)
+
+    def test_select(self):
+        User = self.User
+        self.assertCached(lambda value: User.select().where(User.id == value))
+        self.assertCached(lambda value: User.select().where(
+            (User.name << ['a', str(value)]) | (User.age > value),
+        ).order_by(User.age.desc()).limit(10))
+        self.assertCached(lambda value: User.select(
+            User.name,
+            peewee.fn.COUNT(User.id).alias('count'),
+        ).group_by(User.name).having(peewee.fn.COUNT(User.id) > value))
+        self.assertCached(lambda value: User.select().where(
+            peewee.SQL('age > %s', value),
+        ))
+
+    def test_join(self):
+        User = self.User
+
+        class Post(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+
+            id = ormageddon.PrimaryKeyField()
+            user = ormageddon.ForeignKeyField(User)
+            title = peewee.CharField()
+
+        def build(value):
+            user = User(id=value)
+            return Post.select(Post, User).join(User).where(
+                (Post.user == user) & ~(Post.title.contains(str(value))),
+            )
+        self.assertCached(build)
+        self.assertCached(lambda value: User.select().join(
+            Post,
+            on=(Post.user == User.id) & (Post.title == str(value)),
+        ).where(User.id == value))
+
+    def test_update_and_delete(self):
+        User = self.User
+        self.assertCached(lambda value: User.update(
+            name=str(value),
+            age=User.age + value,
+        ).where(User.id == value))
+        self.assertCached(lambda value: User.delete().where(User.age < value))
+
+    def test_different_shapes(self):
+        User = self.User
+        first = User.select().where(User.id == 1).sql()
+        second = User.select().where(User.age == 1).sql()
+        third = User.select().where(User.id << [1, 2]).sql()
+        self.assertNotEqual(first[0], second[0])
+        self.assertNotEqual(first[0], third[0])
+        self.assertEqual(3, self.db.sql_cache.misses)
+
+    def test_subquery_is_not_cached(self):
+        User = self.User
+        for value in (1, 2):
+            query = User.select().where(
+                User.id << User.select(User.id).where(User.age == value),
+            )
+            self.assertEqual([value], query.sql()[1])
+        self.assertEqual(0, self.db.sql_cache.hits)
+        self.assertEqual(0, self.db.sql_cache.misses)
+
+    def test_disabled(self):
+        self.db.sql_cache = None
+        User = self.User
+        self.assertEqual(
+            self.compile(User.select().where(User.id == 1)),
+            User.select().where(User.id == 1).sql(),
+        )
+
+    def test_insert_defaults(self):
+        counter = itertools.count()
+
+        class Event(ormageddon.Model):
+
+            class Meta:
+                database = self.db
+
+            id = ormageddon.PrimaryKeyField()
+            number = ormageddon.IntegerField(default=lambda: next(counter))
+
+        query = Event.insert()
+
+        async def test():
+            await query.execute()
+            await query.execute()
+        self.run_async(test())
+        self.assertEqual(
+            [[0], [1]],
+            [params for _, params in self.pool.statements],
+        )
+
+
+class StatementCacheTestCase(AsyncTestCase):
+
+    def create_database(self, **kwargs):
+        return super().create_database(statement_cache_size=10, **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.pool.on(r'^PREPARE|; PREPARE', indeterminate_datatype)
+
+    def test_untyped_parameter(self):
+        query = self.User.select(peewee.SQL('%s', 1))
+
+        async def test():
+            await query.scalar()
+            await query.scalar()
+        self.run_async(test())
+        statements = [sql for sql, _ in self.pool.statements]
+        self.assertIn('PREPARE', statements[0])
+        self.assertEqual(['SELECT %s FROM "user" AS t1'] * 2, statements[1:])
+        self.assertNoLeaks()
+
+    def test_untyped_parameter_in_transaction(self):
+        query = self.User.select(peewee.SQL('%s', 1))
+
+        async def test():
+            async with self.db.transaction():
+                return await query.scalar()
+        self.assertEqual(None, self.run_async(test()))
+        statements = [sql for sql, _ in self.pool.statements]
+        self.assertEqual('BEGIN', statements[0])
+        self.assertTrue(statements[1].startswith('SAVEPOINT ormageddon_prepare; '))
+        self.assertEqual(
+            [
+                'ROLLBACK TO SAVEPOINT ormageddon_prepare',
+                'SELECT %s FROM "user" AS t1',
+                'COMMIT',
+            ],
+            statements[2:],
+        )
+        self.assertNoLeaks()
@@ -0,0 +1,125 @@
+import gc
+import re
+
+from tests.base import AsyncTestCase, USERS
+
+
+class StreamTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.rows = iter(USERS + [(4, 'joe', 20), (5, 'jill', 35)])
+        self.pool.on(r'FETCH FORWARD', self.fetch)
+
+    def fetch(self, sql, params):
+        size = int(re.search(r'FETCH FORWARD (\d+)', sql).group(1))
+        rows = [row for _, row in zip(range(size), self.rows)]
+        return [('id',), ('name',), ('age',)], rows, None
+
+    def statements(self):
+        return [
+            re.sub(r'ormageddon_cursor_\d+', 'cursor', sql)
+            for sql, params in self.pool.statements
+        ]
+
+    def declare(self, *prefix):
+        return '; '.join(prefix + (
+            'DECLARE cursor NO SCROLL CURSOR FOR '
+            'SELECT "t1"."id", "t1"."name", "t1"."age" FROM "user" AS t1',
+            'FETCH FORWARD 2 FROM cursor',
+        ))
+
+    def test_batches(self):
+        async def test():
+            async with self.User.select().stream(batch_size=2) as users:
+                return [user.id async for user in users]
+        self.assertEqual([1, 2, 3, 4, 5], self.run_async(test()))
+        # the last batch is shorter, so no more rows are requested
+        self.assertEqual(
+            [
+                self.declare('BEGIN'),
+                'FETCH FORWARD 2 FROM cursor',
+                'FETCH FORWARD 2 FROM cursor',
+                'COMMIT',
+            ],
+            self.statements(),
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_early_break(self):
+        async def test():
+            async with self.User.select().stream(batch_size=2) as users:
+                async for user in users:
+                    break
+        self.run_async(test())
+        self.assertEqual([self.declare('BEGIN'), 'COMMIT'], self.statements())
+        self.assertNoLeaks()
+
+    def test_abandoned_stream(self):
+        async def test():
+            async for user in self.User.select().stream(batch_size=2):
+                return user
+        self.run_async(test())
+        gc.collect()
+        self.settle()
+        self.assertEqual([self.declare('BEGIN'), 'COMMIT'], self.statements())
+        self.assertNoLeaks()
+
+    def test_stream_in_transaction(self):
+        async def test():
+            async with self.db.transaction():
+                async with self.User.select().stream(batch_size=2) as users:
+                    async for user in users:
+                        break
+        self.run_async(test())
+        # cursor is closed without finishing the outer transaction
+        self.assertEqual(
+            ['BEGIN', self.declare(), 'CLOSE cursor', 'COMMIT'],
+            self.statements(),
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+
+class IteratorTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+
+    def test_not_cached(self):
+        query = self.User.select()
+
+        async def test():
+            first = [user.id async for user in query.iterator()]
+            self.assertIsNone(query._qr)
+            second = [user.id async for user in query.iterator()]
+            return first, second
+        self.assertEqual(([1, 2, 3], [1, 2, 3]), self.run_async(test()))
+        # every iteration executes the query again
+        self.assertEqual(2, len(self.pool.statements))
+        self.assertNoLeaks()
+
+    def test_wrapper_not_cached(self):
+        async def test():
+            wrapper = self.User.select().execute()
+            first = [user.id async for user in wrapper.iterator()]
+            return first, wrapper._result_cache
+        self.assertEqual(([1, 2, 3], []), self.run_async(test()))
+        self.assertNoLeaks()
+
+    def test_cached(self):
+        query = self.User.select()
+
+        async def test():
+            first = [user async for user in query]
+            second = [user async for user in query]
+            self.assertEqual(3, len(query._qr._result_cache))
+            return first, second
+        first, second = self.run_async(test())
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.pool.statements))
+        self.assertNoLeaks()
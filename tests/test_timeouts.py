@@ -0,0 +1,99 @@
+import asyncio
+
+from tests.base import AsyncTestCase, rows
+
+
+class TimeoutTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+        self.serve_users()
+        self.pool.on(r'"age" > ', self.slow)
+
+    async def slow(self, sql, params):
+        await asyncio.sleep(10, loop=self.loop)
+        return rows('id', 'name', 'age')(sql, params)
+
+    def slow_query(self):
+        return self.User.select().where(self.User.age > 20)
+
+    def test_query_timeout(self):
+        async def test():
+            with self.assertRaises(asyncio.TimeoutError):
+                await self.slow_query().timeout(0.01).first()
+        self.run_async(test())
+        self.assertEqual([0.01], self.pool.timeouts)
+        self.assertNoLeaks()
+
+    def test_default_timeout(self):
+        self.db.query_timeout = 0.01
+
+        async def test():
+            await self.User.select().first()
+            await self.User.select().timeout(5).first()
+            with self.assertRaises(asyncio.TimeoutError):
+                await self.slow_query().first()
+        self.run_async(test())
+        self.assertEqual([0.01, 5, 0.01], self.pool.timeouts)
+        self.assertNoLeaks()
+
+    def test_cancelled_query(self):
+        async def test():
+            task = asyncio.ensure_future(self.slow_query().first(), loop=self.loop)
+            await asyncio.sleep(0.01, loop=self.loop)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.run_async(test())
+        self.assertNoLeaks()
+
+    def test_transaction_timeout(self):
+        async def test():
+            with self.assertRaises(asyncio.TimeoutError):
+                async with self.db.transaction():
+                    await self.User.update(age=1).execute()
+                    await self.slow_query().timeout(0.01).first()
+        self.run_async(test())
+        self.assertEqual(
+            ['BEGIN', 'UPDATE', 'SELECT', 'ROLLBACK'],
+            [sql.split()[0] for sql, params in self.pool.statements],
+        )
+        self.assertEqual(0.01, self.pool.timeouts[2])
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_cancelled_transaction(self):
+        async def transaction():
+            async with self.db.transaction():
+                await self.slow_query().first()
+
+        async def test():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(transaction(), 0.01, loop=self.loop)
+        self.run_async(test())
+        self.assertEqual('ROLLBACK', self.pool.statements[-1][0])
+        self.assertNoLeaks()
+
+    def test_stream_timeout(self):
+        async def test():
+            with self.assertRaises(asyncio.TimeoutError):
+                async with self.slow_query().timeout(0.01).stream() as users:
+                    async for _ in users:
+                        pass
+        self.run_async(test())
+        self.assertEqual(0.01, self.pool.timeouts[0])
+        self.assertTrue(self.pool.statements[0][0].startswith('BEGIN; DECLARE'))
+        self.assertNoLeaks()
+
+    def test_cancelled_stream(self):
+        async def stream():
+            async with self.slow_query().stream() as users:
+                async for _ in users:
+                    pass
+
+        async def test():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(stream(), 0.01, loop=self.loop)
+        self.run_async(test())
+        self.assertNoLeaks()
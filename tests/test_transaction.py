@@ -0,0 +1,192 @@
+import re
+
+import psycopg2
+
+from tests.base import AsyncTestCase
+
+
+class SerializationFailure(psycopg2.extensions.TransactionRollbackError):
+    pgcode = '40001'
+
+
+class TransactionTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+
+    def test_retries_in_context(self):
+        for kwargs in ({'retries': 3}, {'on_retry': print}):
+            async def test():
+                async with self.db.transaction(**kwargs):
+                    pass
+            with self.assertRaises(TypeError):
+                self.run_async(test())
+        self.assertEqual([], self.pool.statements)
+        self.assertIsNone(self.run_async(self.get_transaction()))
+
+    async def get_transaction(self):
+        return self.db.get_transaction()
+
+    def test_retries(self):
+        failures = iter([True, True, False])
+
+        def update(sql, params):
+            if next(failures):
+                raise SerializationFailure('could not serialize access')
+            return None, [], 1
+        self.pool.on(r'^UPDATE', update)
+        retries = []
+
+        @self.db.transaction(
+            retries=3,
+            backoff=0,
+            on_retry=lambda error, attempt, delay: retries.append(attempt),
+        )
+        async def transfer():
+            return await self.User.update(age=1).execute()
+
+        self.assertEqual(1, self.run_async(transfer()))
+        self.assertEqual([1, 2], retries)
+        self.assertEqual(
+            ['ROLLBACK', 'ROLLBACK', 'COMMIT'],
+            [
+                sql for sql, _ in self.pool.statements
+                if sql in ('COMMIT', 'ROLLBACK')
+            ],
+        )
+        self.assertNoLeaks()
+
+
+class NestedTransactionTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.User = self.create_model()
+
+    def update(self, age):
+        return self.User.update(age=age).execute()
+
+    def statements(self):
+        # savepoint names are unique per process
+        return [
+            re.sub(r'ormageddon_savepoint_\d+', 'sp', sql)
+            for sql, params in self.pool.statements
+        ]
+
+    def test_atomic_top_level(self):
+        async def test():
+            async with self.db.atomic():
+                await self.update(1)
+        self.run_async(test())
+        self.assertEqual(
+            ['BEGIN', 'UPDATE "user" SET "age" = %s', 'COMMIT'],
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_savepoint_release(self):
+        async def test():
+            async with self.db.transaction():
+                async with self.db.atomic():
+                    await self.update(1)
+        self.run_async(test())
+        self.assertEqual(
+            [
+                'BEGIN',
+                'SAVEPOINT sp',
+                'UPDATE "user" SET "age" = %s',
+                'RELEASE SAVEPOINT sp',
+                'COMMIT',
+            ],
+            self.statements(),
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_savepoint_rollback(self):
+        async def test():
+            async with self.db.transaction():
+                await self.update(1)
+                try:
+                    async with self.db.atomic():
+                        await self.update(2)
+                        raise ValueError
+                except ValueError:
+                    pass
+                await self.update(3)
+        self.run_async(test())
+        # only the inner block is undone, the outer one commits
+        self.assertEqual(
+            [
+                'BEGIN',
+                'UPDATE "user" SET "age" = %s',
+                'SAVEPOINT sp',
+                'UPDATE "user" SET "age" = %s',
+                'ROLLBACK TO SAVEPOINT sp; RELEASE SAVEPOINT sp',
+                'UPDATE "user" SET "age" = %s',
+                'COMMIT',
+            ],
+            self.statements(),
+        )
+        self.assertEqual(
+            [[1], [2], [3]],
+            [params for sql, params in self.pool.statements if params],
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_inner_exception_propagates(self):
+        async def test():
+            async with self.db.transaction():
+                async with self.db.atomic():
+                    await self.update(1)
+                    raise ValueError
+        with self.assertRaises(ValueError):
+            self.run_async(test())
+        self.assertEqual(
+            [
+                'BEGIN',
+                'SAVEPOINT sp',
+                'UPDATE "user" SET "age" = %s',
+                'ROLLBACK TO SAVEPOINT sp; RELEASE SAVEPOINT sp',
+                'ROLLBACK',
+            ],
+            self.statements(),
+        )
+        self.assertNoLeaks()
+
+    def test_joined_transaction(self):
+        async def test():
+            async with self.db.transaction() as outer:
+                async with self.db.transaction() as inner:
+                    self.assertIs(outer, inner)
+                    await self.update(1)
+                await self.update(2)
+        self.run_async(test())
+        # the outer block alone commits
+        self.assertEqual(
+            [
+                'BEGIN',
+                'UPDATE "user" SET "age" = %s',
+                'UPDATE "user" SET "age" = %s',
+                'COMMIT',
+            ],
+            self.statements(),
+        )
+        self.assertEqual(1, self.pool.acquired)
+        self.assertNoLeaks()
+
+    def test_joined_transaction_failure(self):
+        async def test():
+            async with self.db.transaction():
+                async with self.db.transaction():
+                    await self.update(1)
+                    raise ValueError
+        with self.assertRaises(ValueError):
+            self.run_async(test())
+        self.assertEqual(
+            ['BEGIN', 'UPDATE "user" SET "age" = %s', 'ROLLBACK'],
+            self.statements(),
+        )
+        self.assertNoLeaks()